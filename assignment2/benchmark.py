@@ -0,0 +1,198 @@
+import argparse
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from jobScheduler import HEAP_BACKEND, NUMPY_BACKEND, SAMPLED_BACKEND, serverQueue
+from shardedScheduler import shardedQueue
+from simulator import virtualClock
+import metrics
+
+SIZES = ["1", "10", "50", "200", "1000"]
+
+
+def scenarioName(scenario):
+    return ",".join(f"{k}={v}" for k, v in sorted(scenario.items()))
+
+
+def makeQueue(numServers, backend, clock, shards=0):
+    # shards > 0 runs the servers in that many shardedQueue processes
+    servernames = [f"s{i}" for i in range(numServers)]
+    if shards:
+        return shardedQueue(servernames, clock(), shards, clock=clock, backend=backend)
+    return serverQueue(servernames, clock(), backend, clock=clock)
+
+
+def _probeAll(sq, numServers, rnd, clock):
+    # One known size job completed on every server, so all servers are
+    # force fed and have a measured B: the timed decisions then go through
+    # the priority index instead of the force feed queue.
+    probes = [(f"p{i}", rnd.choice(SIZES)) for i in range(numServers)]
+    sq.assignBatch(probes)
+    clock.now += 1.0
+    sq.assignBatch([], [name for name, _ in probes])
+
+
+def _fill(sq, numJobs, unknownRatio, rnd, clock):
+    names = []
+    for i in range(numJobs):
+        clock.now += 0.001
+        name = f"w{i}"
+        sq.getServer(name, "-1" if rnd.random() < unknownRatio else rnd.choice(SIZES))
+        names.append(name)
+    return names
+
+
+def measureMemory(scenario):
+    # bytes per server after construction and probing, per in-flight job
+    # after filling
+    clock = virtualClock()
+    rnd = random.Random(0)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sq = makeQueue(scenario["servers"], scenario["backend"], clock)
+    _probeAll(sq, scenario["servers"], rnd, clock)
+    afterServers = tracemalloc.get_traced_memory()[0]
+    _fill(sq, scenario["inflight"], scenario["unknown"], rnd, clock)
+    afterJobs = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return ((afterServers - before) / scenario["servers"],
+            (afterJobs - afterServers) / max(1, scenario["inflight"]))
+
+
+def measureThroughput(scenario, numOps, seed=0):
+    # Keeps `inflight` jobs in the queue: every batch completes `burst`
+    # random jobs and places `burst` new arrivals with assignBatch. With
+    # shards the latency is the front-end's share only, the shards answer
+    # while it goes on with the next batch.
+    clock = virtualClock()
+    rnd = random.Random(seed)
+    sq = makeQueue(scenario["servers"], scenario["backend"], clock, scenario["shards"])
+    _probeAll(sq, scenario["servers"], rnd, clock)
+    inflight = _fill(sq, scenario["inflight"], scenario["unknown"], rnd, clock)
+    if scenario["shards"]:
+        sq.flush()
+        sq.takeReleased()
+    burst = scenario["burst"]
+    latency = metrics.latencyHistogram(precision=0.02, minValue=1)
+    numBatches = max(1, numOps // (2 * burst))
+    perfCounter = time.perf_counter_ns
+
+    start = perfCounter()
+    for b in range(numBatches):
+        clock.now += 0.001
+        completions = []
+        for _ in range(min(burst, len(inflight))):
+            i = rnd.randrange(len(inflight))
+            inflight[i], inflight[-1] = inflight[-1], inflight[i]
+            completions.append(inflight.pop())
+        arrivals = [(f"b{b}_{k}", "-1" if rnd.random() < scenario["unknown"] else rnd.choice(SIZES))
+                    for k in range(burst)]
+        batchStart = perfCounter()
+        sq.assignBatch(arrivals, completions)
+        sq.takeReleased()
+        perDecision = (perfCounter() - batchStart) / (len(completions) + len(arrivals))
+        latency.add(perDecision)
+        inflight.extend(name for name, _ in arrivals)
+    if scenario["shards"]:
+        # the shards answer asynchronously, the last replies count too
+        sq.flush()
+    elapsed = (perfCounter() - start) / 1e9
+    if scenario["shards"]:
+        sq.close()
+    decisions = numBatches * 2 * burst
+    return {"opsPerSec": decisions / elapsed, "p50_ns": latency.percentile(50),
+            "p95_ns": latency.percentile(95), "p99_ns": latency.percentile(99)}
+
+
+def runSuite(scenarios, numOps, memory=True):
+    results = []
+    for scenario in scenarios:
+        result = dict(scenario)
+        result.update(measureThroughput(scenario, numOps))
+        # the shards' memory is in other processes
+        if memory and not scenario["shards"]:
+            result["bytesPerServer"], result["bytesPerJob"] = measureMemory(scenario)
+        print(f"{scenarioName(scenario)}: {result['opsPerSec']:.0f} ops/s "
+              f"p50={result['p50_ns']:.0f}ns p99={result['p99_ns']:.0f}ns", flush=True)
+        results.append(result)
+    return results
+
+
+def makeScenarios(servers, inflight, unknown, burst, backends, shards=(0,)):
+    return [{"servers": s, "inflight": j, "unknown": u, "burst": b, "backend": backend, "shards": n}
+            for s, j, u, b, backend, n in itertools.product(servers, inflight, unknown, burst, backends, shards)]
+
+
+def compare(baseline, current, threshold):
+    # regressions in throughput or p99 latency beyond threshold (a ratio)
+    baseResults = {scenarioName(_scenarioOf(r)): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        name = scenarioName(_scenarioOf(result))
+        base = baseResults.get(name)
+        if base is None:
+            continue
+        throughput = result["opsPerSec"] / base["opsPerSec"] - 1
+        p99 = result["p99_ns"] / base["p99_ns"] - 1
+        flag = ""
+        if throughput < -threshold or p99 > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name}: ops/s {throughput:+.1%} p99 {p99:+.1%}{flag}")
+    return regressions
+
+
+def _scenarioOf(result):
+    # results written before sharding have no shards field
+    scenario = {k: result[k] for k in ("servers", "inflight", "unknown", "burst", "backend")}
+    scenario["shards"] = result.get("shards", 0)
+    return scenario
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the serverQueue scheduling core.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmark suite")
+    run.add_argument('--servers', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    run.add_argument('--inflight', type=int, nargs='+', default=[1000])
+    run.add_argument('--unknown', type=float, nargs='+', default=[0.0, 0.5])
+    run.add_argument('--burst', type=int, nargs='+', default=[1, 32])
+    run.add_argument('--backend', nargs='+', default=[HEAP_BACKEND],
+                     choices=[HEAP_BACKEND, NUMPY_BACKEND, SAMPLED_BACKEND])
+    run.add_argument('--shards', type=int, nargs='+', default=[0],
+                     help='scheduler processes of a shardedQueue, 0 is a single in-process serverQueue')
+    run.add_argument('--ops', type=int, default=20000, help='decisions timed per scenario')
+    run.add_argument('--no-memory', dest="memory", action='store_false')
+    run.add_argument('--out', help='JSON file for the results')
+
+    cmp = commands.add_parser("compare", help="compare results against a baseline")
+    cmp.add_argument('baseline')
+    cmp.add_argument('current')
+    cmp.add_argument('--threshold', type=float, default=0.1,
+                     help='allowed slowdown, 0.1 is 10%% fewer ops/s or 10%% higher p99')
+    args = parser.parse_args()
+
+    if args.command == "run":
+        scenarios = makeScenarios(args.servers, args.inflight, args.unknown, args.burst, args.backend,
+                                  args.shards)
+        results = runSuite(scenarios, args.ops, args.memory)
+        report = {"meta": {"python": platform.python_version(), "machine": platform.machine(),
+                           "time": time.time(), "ops": args.ops},
+                  "results": results}
+        if args.out:
+            with open(args.out, "w") as file:
+                json.dump(report, file, indent=2)
+    else:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.current) as file:
+            current = json.load(file)
+        regressions = compare(baseline, current, args.threshold)
+        print(f"{len(regressions)} regressions")
+        sys.exit(1 if regressions else 0)
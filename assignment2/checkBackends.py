@@ -0,0 +1,81 @@
+import argparse
+import math
+import random
+import sys
+
+from jobScheduler import HEAP_BACKEND, NUMPY_BACKEND, np, priorityKey, serverQueue
+from simulator import virtualClock
+
+SIZES = ["5", "10", "50", "200", "1000"]
+
+
+def scanTop(sq):
+    # the reference: every P in one pass, the first server with the highest
+    # P in servernames order, None when none is positive
+    best = None
+    bestKey = 0
+    for name, serverDetail in sq.serverDetails.items():
+        key = priorityKey(serverDetail, sq.usePFL, sq.config.pflSmoothing)
+        if key > bestKey:
+            best = name
+            bestKey = key
+    return best
+
+
+def runBackend(backend, seed, numServers, numOps):
+    # Random arrivals and completions on one queue. Returns the placements
+    # and final bandwidths, plus the decisions where the backend did not
+    # pick the server of scanTop.
+    rnd = random.Random(seed)
+    clock = virtualClock()
+    sq = serverQueue([str(i) for i in range(numServers)], clock.now, backend, clock=clock)
+    inflight = []
+    placements = []
+    wrong = []
+    for i in range(numOps):
+        clock.now += rnd.uniform(0.000001, 0.3)
+        if inflight and rnd.random() < 0.45:
+            sq.removeJob(inflight.pop(rnd.randrange(len(inflight))))
+            continue
+        size = "-1" if rnd.random() < 0.3 else rnd.choice(SIZES)
+        forceFed = not (sq._hasForceFedAll() or sq._isUnknownJobSize(size))
+        expected = None if forceFed else scanTop(sq)
+        server = sq.getServer(f"j{i}", size)
+        if not forceFed and server != expected:
+            wrong.append((i, server, expected))
+        placements.append(server)
+        inflight.append(f"j{i}")
+    return placements, {name: d.bandwidth for name, d in sq.serverDetails.items()}, wrong
+
+
+def check(seeds, numOps):
+    # number of runs where a backend strayed from the reference or the two
+    # backends disagree
+    backends = [HEAP_BACKEND] + ([NUMPY_BACKEND] if np is not None else [])
+    failures = 0
+    for seed in range(seeds):
+        numServers = random.Random(seed).choice([1, 2, 3, 10, 40, 200])
+        runs = {backend: runBackend(backend, seed, numServers, numOps) for backend in backends}
+        for backend, (_, _, wrong) in runs.items():
+            if wrong:
+                failures += 1
+                print(f"seed {seed}: {backend} differs from the scan at decision {wrong[0]}")
+        if len(runs) == 2:
+            (heapPlaced, heapB, _), (numpyPlaced, numpyB, _) = runs.values()
+            if heapPlaced != numpyPlaced or any(not math.isclose(heapB[k], numpyB[k]) for k in heapB):
+                failures += 1
+                print(f"seed {seed}: {HEAP_BACKEND} and {NUMPY_BACKEND} disagree")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks the priority backends against a full scan.")
+    parser.add_argument('--seeds', dest="seeds", type=int, default=200)
+    parser.add_argument('--ops', dest="ops", type=int, default=600, help='arrivals and completions per run')
+    args = parser.parse_args()
+
+    if np is None:
+        print(f"NumPy is not installed, only checking the {HEAP_BACKEND} backend")
+    failures = check(args.seeds, args.ops)
+    print(f"{failures} failures in {args.seeds} runs")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,230 @@
+import argparse
+import heapq
+import os
+import pickle
+import random
+import selectors
+import socket
+import sys
+import time
+
+CONFIG_CLIENT = "config_client"
+CONFIG_SERVER = "config_server"
+CLIENT_PICKLE = "client.pickle"
+SERVER_PICKLE = "server.pickle"
+UNKNOWN_SIZE = "-1"
+
+
+def _configLines(path):
+    with open(path, 'r') as config:
+        for line in config:
+            line = line.strip()
+            if line == "" or line[0] == "#":
+                continue
+            yield line.split(',')
+
+
+# time, filename, filesize
+def readClientConfig(path):
+    return [(float(timestamp), filename, float(filesize))
+            for timestamp, filename, filesize in _configLines(path)]
+
+
+# servername, bandwidth
+def readServerConfig(path):
+    return [(servername, float(bandwidth)) for servername, bandwidth in _configLines(path)]
+
+
+def formatSize(size):
+    return str(int(size)) if float(size).is_integer() else str(size)
+
+
+class processorSharingServer:
+    # A server that splits its bandwidth equally between all active jobs.
+    # virtualTime is the service each active job has received so far, so a
+    # job admitted at virtualTime v with size s finishes when virtualTime
+    # reaches v + s, and only the earliest of those needs to be looked at.
+
+
+    def __init__(self, name, bandwidth, startTime=0.0):
+        self.name = name
+        self.bandwidth = bandwidth
+        self.virtualTime = 0.0
+        self.lastTime = startTime
+        self.finishing = []  # heap of (virtual finish time, id, filename)
+        self.numAdded = 0
+
+
+    def __len__(self):
+        return len(self.finishing)
+
+
+    def _advanceTo(self, now):
+        if self.finishing and now > self.lastTime:
+            self.virtualTime += self.bandwidth * (now - self.lastTime) / len(self.finishing)
+        self.lastTime = max(self.lastTime, now)
+
+
+    def add(self, filename, size, now):
+        self._advanceTo(now)
+        self.numAdded += 1
+        heapq.heappush(self.finishing, (self.virtualTime + size, self.numAdded, filename))
+
+
+    def setBandwidth(self, bandwidth, now):
+        self._advanceTo(now)
+        self.bandwidth = bandwidth
+
+
+    def nextCompletionTime(self):
+        if not self.finishing:
+            return None
+        remaining = max(0.0, self.finishing[0][0] - self.virtualTime)
+        return self.lastTime + remaining * len(self.finishing) / self.bandwidth
+
+
+    def complete(self, now):
+        # filenames and exact completion times of every job finished by now
+        finished = []
+        completionTime = self.nextCompletionTime()
+        while completionTime is not None and completionTime <= now:
+            self._advanceTo(completionTime)
+            virtualFinish, _, filename = heapq.heappop(self.finishing)
+            self.virtualTime = max(self.virtualTime, virtualFinish)
+            finished.append((filename, completionTime))
+            completionTime = self.nextCompletionTime()
+        self._advanceTo(now)
+        return finished
+
+
+class emulator:
+    # Plays config_client against the scheduler connected on the socket and
+    # runs the assigned jobs on processor-sharing servers built from
+    # config_server. Completions are checked every tick seconds, like the
+    # 50ms granularity of the course emulator.
+
+
+    def __init__(self, requests, servers, prob=0, tick=0.05, seed=None, startDelay=0.5):
+        self.requests = sorted(requests, key=lambda r: r[0])
+        self.servers = {name: processorSharingServer(name, bandwidth) for name, bandwidth in servers}
+        self.sizes = {filename: size for _, filename, size in self.requests}
+        self.prob = prob
+        self.tick = tick
+        self.startDelay = startDelay
+        self.random = random.Random(seed)
+        self.tsBegin = {}
+        self.tsComplete = {}
+        self.buffer = b""
+
+
+    def _sendRequests(self, sock, now, startTime, nextRequest):
+        lines = []
+        while nextRequest < len(self.requests) and self.requests[nextRequest][0] <= now - startTime:
+            _, filename, size = self.requests[nextRequest]
+            hidden = self.random.random() * 100 < self.prob
+            lines.append(f"{filename},{UNKNOWN_SIZE if hidden else formatSize(size)}\n")
+            self.tsBegin[filename] = now
+            nextRequest += 1
+        if lines:
+            sock.sendall("".join(lines).encode())
+        return nextRequest
+
+
+    def _receiveAssignments(self, sock, now):
+        data = sock.recv(65536)
+        if data == b"":
+            return False
+        lines = (self.buffer + data).split(b"\n")
+        self.buffer = lines.pop()
+        for line in lines:
+            line = line.decode()
+            if line == "printAll":
+                self.printAll(now)
+                continue
+            # servername, filename, jobsize
+            servername, filename, _ = line.split(",")[:3]
+            self.servers[servername].add(filename, self.sizes[filename], now)
+        return True
+
+
+    def _sendCompletions(self, sock, now):
+        lines = []
+        for server in self.servers.values():
+            for filename, _ in server.complete(now):
+                self.tsComplete[filename] = now
+                lines.append(f"F{filename}\n")
+        if lines:
+            sock.sendall("".join(lines).encode())
+
+
+    def printAll(self, now):
+        for name, server in self.servers.items():
+            print(f"[Emulator] {name}: bandwidth={server.bandwidth} active={len(server)}")
+
+
+    def run(self, sock):
+        sock.sendall("".join(f"{name}," for name in self.servers).encode())
+        # the servernames are not newline terminated, give the scheduler time
+        # to read them before the first requests
+        time.sleep(self.startDelay)
+
+        selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ)
+        startTime = time.monotonic()
+        nextTick = startTime
+        nextRequest = 0
+        while len(self.tsComplete) < len(self.requests):
+            now = time.monotonic()
+            nextRequest = self._sendRequests(sock, now, startTime, nextRequest)
+            if now >= nextTick:
+                self._sendCompletions(sock, now)
+                nextTick = now + self.tick
+
+            deadline = nextTick
+            if nextRequest < len(self.requests):
+                deadline = min(deadline, startTime + self.requests[nextRequest][0])
+            if selector.select(max(0, deadline - time.monotonic())):
+                if not self._receiveAssignments(sock, time.monotonic()):
+                    print("[Emulator] Scheduler closed the connection.")
+                    break
+        selector.close()
+
+
+    def writePickles(self, directory):
+        with open(os.path.join(directory, CLIENT_PICKLE), "wb") as file:
+            pickle.dump(self.tsBegin, file)
+        with open(os.path.join(directory, SERVER_PICKLE), "wb") as file:
+            pickle.dump(self.tsComplete, file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emulator of the servers and client.")
+    parser.add_argument('-port', '--port', action='store', type=int, required=True,
+                        help='port the scheduler connects to')
+    parser.add_argument('-prob', '--prob', action='store', type=float, default=0,
+                        help='probability (in %%) that a request is sent with size -1')
+    parser.add_argument('-dir', '--dir', action='store', default='.',
+                        help='directory with config_client/config_server, pickles are written there')
+    parser.add_argument('-tick', '--tick', action='store', type=float, default=0.05,
+                        help='seconds between two completion checks')
+    parser.add_argument('-seed', '--seed', action='store', type=int, default=None,
+                        help='seed for hiding the sizes')
+    args = parser.parse_args()
+
+    requests = readClientConfig(os.path.join(args.dir, CONFIG_CLIENT))
+    servers = readServerConfig(os.path.join(args.dir, CONFIG_SERVER))
+    emu = emulator(requests, servers, args.prob, args.tick, args.seed)
+
+    listenSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listenSocket.bind(('127.0.0.1', args.port))
+    listenSocket.listen(1)
+    print(f"[Emulator] Listening on port {args.port}", flush=True)
+    schedulerSocket, _ = listenSocket.accept()
+    listenSocket.close()
+
+    emu.run(schedulerSocket)
+    schedulerSocket.close()
+    emu.writePickles(args.dir)
+    print(f"[Emulator] {len(emu.tsComplete)}/{len(requests)} jobs completed.")
+    sys.exit(0 if len(emu.tsComplete) == len(requests) else 1)
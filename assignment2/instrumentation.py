@@ -0,0 +1,132 @@
+import json
+import time
+from collections import defaultdict
+
+import metrics
+import policies
+
+# serverQueue methods timed while attached, other policies only have the
+# public ones
+TIMED = ("getServer", "removeJob", "assignBatch", "_updatePs", "_updateP", "_updateJ")
+
+
+class instrumentation:
+    # Times serverQueue methods with perf_counter_ns and counts policy
+    # decisions. attach() shadows the methods with timed wrappers on the
+    # instance and detach() deletes them again, so a detached queue runs
+    # the plain class methods with no overhead at all.
+
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.timers = {name: metrics.latencyHistogram(precision=0.05, minValue=1) for name in TIMED}
+        self.attached = None
+        self.since = time.time()
+
+
+    @property
+    def enabled(self):
+        return self.attached is not None
+
+
+    def _timed(self, name, method):
+        histogram = self.timers[name]
+        clock = time.perf_counter_ns
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                histogram.add(clock() - start)
+        return wrapper
+
+
+    def _wrap(self, sq):
+        counters = self.counters
+        wrappers = {name: self._timed(name, getattr(sq, name)) for name in TIMED if hasattr(sq, name)}
+
+        timedGetServer = wrappers["getServer"]
+        def getServer(jobName, jobSize):
+            if policies.isUnknownJobSize(jobSize):
+                counters["unknownSizeJobs"] += 1
+            counters["assignedJobs"] += 1
+            return timedGetServer(jobName, jobSize)
+        wrappers["getServer"] = getServer
+
+        timedRemoveJob = wrappers["removeJob"]
+        def removeJob(jobName):
+            counters["completedJobs"] += 1
+            return timedRemoveJob(jobName)
+        wrappers["removeJob"] = removeJob
+        if not hasattr(sq, "_forceFeed"):
+            return wrappers
+
+        forceFeed = sq._forceFeed
+        def _forceFeed():
+            server = forceFeed()
+            if server is not None:
+                counters["forceFeeds"] += 1
+            return server
+        wrappers["_forceFeed"] = _forceFeed
+
+        serverStopEB = sq._serverStopEB
+        def _serverStopEB(serverDetail):
+            counters["probeCompletions"] += 1
+            return serverStopEB(serverDetail)
+        wrappers["_serverStopEB"] = _serverStopEB
+        return wrappers
+
+
+    def attach(self, sq):
+        if self.attached is sq:
+            return
+        self.detach()
+        for name, wrapper in self._wrap(sq).items():
+            setattr(sq, name, wrapper)
+        self.attached = sq
+
+
+    def detach(self):
+        if self.attached is None:
+            return
+        for name in list(vars(self.attached)):
+            if name in TIMED or name in ("_forceFeed", "_serverStopEB"):
+                delattr(self.attached, name)
+        self.attached = None
+
+
+    def toggle(self, sq):
+        if self.enabled:
+            self.detach()
+        else:
+            self.attach(sq)
+
+
+    def reset(self):
+        self.counters.clear()
+        for name in TIMED:
+            self.timers[name] = metrics.latencyHistogram(precision=0.05, minValue=1)
+        self.since = time.time()
+        if self.attached is not None:
+            sq = self.attached
+            self.detach()
+            self.attach(sq)
+
+
+    def snapshot(self):
+        timers = {}
+        for name, histogram in self.timers.items():
+            if histogram.count == 0:
+                continue
+            timers[name] = {"count": histogram.count, "mean_ns": histogram.mean(),
+                            "p50_ns": histogram.percentile(50), "p99_ns": histogram.percentile(99),
+                            "max_ns": histogram.max}
+        return {"time": time.time(), "since": self.since, "enabled": self.enabled,
+                "counters": dict(self.counters), "timers": timers}
+
+
+    def dump(self, path):
+        # one JSON object per line
+        with open(path, "a") as file:
+            file.write(json.dumps(self.snapshot()) + "\n")
@@ -1,125 +1,617 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import socket
 import sys
 import argparse
 import signal
 import time
+import heapq
+import json
+import os
+import random
+import selectors
+from collections import defaultdict, deque
 from typing import Tuple
 
-J = "Jobs"
-LUT = "Last Update Time"
-NACJ = "Num Active Jobs"
-ACL = "Active Load"
-B = "Bandwidth"
-P = "Priority"
-NASJ = "Num Assigned Jobs"
-ASL = "Assigned Load"
+import instrumentation
+import jobTable
+import metrics
+import policies
+import snapshot
+import statusLogger
+import traceLog
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 DB = 50.0  # Default Bandwidth
-EB = "Estimating Bandwidth"
-FF = "Force Fed"
+DL = 200.0  # Default Load
 
 MODE_D = "MODE_DECREASE"
 MODE_I = "MODE_INCREASE"
 
-class serverQueue:
-
-    def __init__(self, servernames, startTime):
-        self.serverDetails = {name: {
-            J: dict(),
-            LUT: startTime,
-            NACJ: 0,
-            B: DB,
-            P: 0,
-            NASJ: 0,
-            EB: 0,
-            ACL: 0,
-            ASL: 0,
-            FF: 0,
-            } for name in servernames}
-        self.jobDetails = {}
-        self.numForceFed = 0
-        self.TFL = 0 # Total Finished Load
-        self.DL = 200.0  # Default Load
-        self._updatePs()
+PFL_THRESHOLD = 1000  # TFL needed before PFL is used in the priority
+
+PFL_SMOOTHING = 0.1  # added to the finished load of every server
+
+BANDWIDTH_HALF_LIFE = 2.0  # seconds for a B sample to lose half its weight
+
+DEFAULT_CLASS = ""  # class of requests without a class field
+DEFAULT_CLASS_WEIGHT = 1.0
+
+PRIOR_TIME = 1.0  # seconds of default bandwidth assumed before any completion
+
+REAPS_PER_TTL = 4  # scans for stale jobs per jobTTL
+
+
+class schedulerConfig:
+    # Tunable constants of the policy. loadWeight is the weight of a new
+    # known job size in the default load EWMA; 0 keeps DL at defaultLoad,
+    # which is what the scheduler did before the EWMA was wired in.
+    # bandwidthHalfLife (seconds) keeps refining B from every known size
+    # completion, older samples losing half their weight per half-life; 0
+    # keeps the B measured by the first probe job forever.
+    # classWeights maps the optional class field of a request to its fair
+    # share weight (DEFAULT_CLASS_WEIGHT if missing). With admissionLoad > 0
+    # jobs of every class but the heaviest are held back while every server
+    # would have more than admissionLoad active with them.
+    # Jobs in flight for longer than jobTTL seconds are assumed to have lost
+    # their completion and are dropped from their server; 0 keeps them.
+    FIELDS = ("defaultBandwidth", "defaultLoad", "loadWeight", "pflThreshold", "pflSmoothing",
+              "bandwidthHalfLife", "classWeights", "admissionLoad", "jobTTL")
+
+
+    def __init__(self, defaultBandwidth=DB, defaultLoad=DL, loadWeight=0.0,
+                 pflThreshold=PFL_THRESHOLD, pflSmoothing=PFL_SMOOTHING,
+                 bandwidthHalfLife=BANDWIDTH_HALF_LIFE, classWeights=None, admissionLoad=0.0,
+                 jobTTL=0.0):
+        self.defaultBandwidth = defaultBandwidth
+        self.defaultLoad = defaultLoad
+        self.loadWeight = loadWeight
+        self.pflThreshold = pflThreshold
+        self.pflSmoothing = pflSmoothing
+        self.bandwidthHalfLife = bandwidthHalfLife
+        self.classWeights = dict(classWeights or {})
+        self.admissionLoad = admissionLoad
+        self.jobTTL = jobTTL
+
+
+    @classmethod
+    def fromFile(cls, path):
+        # JSON object with any of FIELDS, e.g. a config reported by tuner.py
+        with open(path) as file:
+            return cls(**json.load(file))
+
+
+    def asDict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
 
+    def __repr__(self):
+        return " ".join(f"{k}={v}" for k, v in self.asDict().items())
 
-    def _findServerWithMost(self, attribute):
-        serverDetail = self.serverDetails
-        maxVal = 0
-        server = None
 
-        for key in serverDetail.keys():
-            if serverDetail[key][attribute] > maxVal:
-                server = key
-                maxVal = serverDetail[key][attribute]
+HEAP_BACKEND = "heap"
+NUMPY_BACKEND = "numpy"
+SAMPLED_BACKEND = "sampled"
+
+SAMPLE_SIZE = 2  # servers compared per decision by the sampled backend
+
+POLL_LOOP = "poll"
+SELECT_LOOP = "select"
+
+PRIORITY_MODE = "priority"
+FINISH_TIME_MODE = "finishTime"
+
+PRIORITY_POLICY = PRIORITY_MODE
+FINISH_TIME_POLICY = FINISH_TIME_MODE
+
+
+def priorityKey(serverDetail, usePFL, smoothing=PFL_SMOOTHING):
+    # P without the 1 / TFL factor, which is common to every server and is
+    # applied by the index as a scale
+    key = serverDetail.bandwidth / max(1, serverDetail.activeLoad)
+    if usePFL:
+        key *= serverDetail.assignedLoad - serverDetail.activeLoad + smoothing
+    return key
+
+
+def finishTime(serverDetail, load):
+    # Predicted time for a new job of the given load to finish on the
+    # server under processor sharing: until it is done, every active job
+    # gets the same share, so each of them delays it by at most its own
+    # remaining load. Remaining loads are not tracked per job, so their sum
+    # is capped by NACJ * load instead.
+    bandwidth = serverDetail.bandwidth
+    if serverDetail.estimatingBandwidth:
+        finishedLoad = serverDetail.assignedLoad - serverDetail.activeLoad
+        busy = serverDetail.busyTime / 1_000_000
+        bandwidth = (finishedLoad + bandwidth * PRIOR_TIME) / (busy + PRIOR_TIME)
+    if bandwidth <= 0:
+        return float("inf")
+    delay = min(serverDetail.activeLoad, serverDetail.numActiveJobs * load)
+    return (delay + load) / bandwidth
+
+
+class priorityIndex:
+    # Lazy-deletion max-heap over server priorities. Entries are
+    # (-key, order, version, server); an entry is stale once the server has
+    # been pushed again with a newer version. Ties are broken by order so the
+    # first server (in servernames order) with the highest key wins.
+
+
+    def __init__(self, servernames, smoothing=PFL_SMOOTHING):
+        self.order = {name: i for i, name in enumerate(servernames)}
+        self.smoothing = smoothing
+        self.keys = {name: 0 for name in self.order}
+        self.versions = {name: 0 for name in self.order}
+        self.heap = []
+        self.scale = 1.0
+        self.usePFL = False
+
+
+    def update(self, serverDetail):
+        server = serverDetail.name
+        key = priorityKey(serverDetail, self.usePFL, self.smoothing)
+        version = self.versions[server] + 1
+        self.versions[server] = version
+        self.keys[server] = key
+        heapq.heappush(self.heap, (-key, self.order[server], version, server))
+        if len(self.heap) > 2 * len(self.order) + 16:
+            self._compact()
+
+
+    def rebuild(self, serverDetails, usePFL, scale):
+        self.usePFL = usePFL
+        self.scale = scale
+        for server, serverDetail in serverDetails.items():
+            self.keys[server] = priorityKey(serverDetail, usePFL, self.smoothing)
+            self.versions[server] += 1
+        self._compact()
+
+
+    def rescale(self, scale):
+        # a global factor shared by every key does not change the order
+        self.scale = scale
+
+
+    def priority(self, server):
+        return self.keys[server] * self.scale
+
+
+    def top(self):
+        heap = self.heap
+        versions = self.versions
+        while heap and heap[0][2] != versions[heap[0][3]]:
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        negKey, _, _, server = heap[0]
+        if -negKey * self.scale <= 0:
+            return None
         return server
 
 
+    def topWithin(self, serverDetails, limit):
+        # The first server in P order with ACL <= limit. Pops entries until
+        # it finds one: stale entries are dropped for good, the valid ones
+        # are pushed back, O(k log n) for the k servers ranked above it.
+        heap = self.heap
+        versions = self.versions
+        popped = []
+        best = None
+        while heap:
+            entry = heapq.heappop(heap)
+            if entry[2] != versions[entry[3]]:
+                continue
+            popped.append(entry)
+            if serverDetails[entry[3]].activeLoad <= limit:
+                best = entry[3]
+                break
+        for entry in popped:
+            heapq.heappush(heap, entry)
+        return best
+
+
+    def _compact(self):
+        self.heap = [(-key, self.order[server], self.versions[server], server)
+                     for server, key in self.keys.items()]
+        heapq.heapify(self.heap)
+
+
+class numpyPriorityIndex:
+    # Keeps B, ACL and ASL as columns indexed by server order and computes
+    # every P plus the argmax in one vectorized pass. np.argmax returns the
+    # first maximum, so ties go to the same server as in priorityIndex.
+
+
+    def __init__(self, servernames, smoothing=PFL_SMOOTHING):
+        self.servernames = list(servernames)
+        self.smoothing = smoothing
+        self.order = {name: i for i, name in enumerate(self.servernames)}
+        n = len(self.servernames)
+        self.bandwidth = np.zeros(n)
+        self.activeLoad = np.zeros(n)
+        self.assignedLoad = np.zeros(n)
+        self.scale = 1.0
+        self.usePFL = False
+
+
+    def update(self, serverDetail):
+        i = self.order[serverDetail.name]
+        self.bandwidth[i] = serverDetail.bandwidth
+        self.activeLoad[i] = serverDetail.activeLoad
+        self.assignedLoad[i] = serverDetail.assignedLoad
+
+
+    def rebuild(self, serverDetails, usePFL, scale):
+        self.usePFL = usePFL
+        self.scale = scale
+        for serverDetail in serverDetails.values():
+            self.update(serverDetail)
+
+
+    def rescale(self, scale):
+        self.scale = scale
+
+
+    def _keys(self):
+        keys = self.bandwidth / np.maximum(1, self.activeLoad)
+        if self.usePFL:
+            keys *= self.assignedLoad - self.activeLoad + self.smoothing
+        return keys
+
+
+    def priority(self, server):
+        i = self.order[server]
+        key = self.bandwidth[i] / max(1, self.activeLoad[i])
+        if self.usePFL:
+            key *= self.assignedLoad[i] - self.activeLoad[i] + self.smoothing
+        return float(key) * self.scale
+
+
+    def top(self):
+        if not self.servernames:
+            return None
+        keys = self._keys()
+        i = int(np.argmax(keys))
+        if keys[i] * self.scale <= 0:
+            return None
+        return self.servernames[i]
+
+
+    def topWithin(self, serverDetails, limit):
+        # the first server in P order with ACL <= limit, in one pass
+        if not self.servernames:
+            return None
+        keys = np.where(self.activeLoad <= limit, self._keys(), -np.inf)
+        i = int(np.argmax(keys))
+        if keys[i] == -np.inf:
+            return None
+        return self.servernames[i]
+
+
+class sampledPriorityIndex:
+    # Power of d choices: top() computes P for d random servers only and
+    # returns the best of them, so nothing is kept up to date between
+    # decisions and every operation is O(d) whatever the number of servers.
+    # Ties go to the first of the sampled servers in servernames order.
+
+
+    def __init__(self, servernames, smoothing=PFL_SMOOTHING, sampleSize=SAMPLE_SIZE, seed=0):
+        self.order = {name: i for i, name in enumerate(servernames)}
+        self.smoothing = smoothing
+        self.sampleSize = sampleSize
+        self.rnd = random.Random(seed)
+        self.serverDetails = {}
+        self.records = []
+        self.scale = 1.0
+        self.usePFL = False
+
+
+    def update(self, serverDetail):
+        pass
+
+
+    def rebuild(self, serverDetails, usePFL, scale):
+        self.serverDetails = serverDetails
+        self.records = list(serverDetails.values())
+        self.usePFL = usePFL
+        self.scale = scale
+
+
+    def rescale(self, scale):
+        self.scale = scale
+
+
+    def priority(self, server):
+        return priorityKey(self.serverDetails[server], self.usePFL, self.smoothing) * self.scale
+
+
+    def sample(self):
+        if len(self.records) <= self.sampleSize:
+            return self.records
+        return self.rnd.sample(self.records, self.sampleSize)
+
+
+    def top(self):
+        best = None
+        bestKey = 0
+        order = self.order
+        for serverDetail in self.sample():
+            key = priorityKey(serverDetail, self.usePFL, self.smoothing)
+            if key > bestKey or (key == bestKey and best is not None
+                                 and order[serverDetail.name] < order[best]):
+                best = serverDetail.name
+                bestKey = key
+        if best is None or bestKey * self.scale <= 0:
+            return None
+        return best
+
+
+    def topWithin(self, serverDetails, limit):
+        # the best of the sampled servers with ACL <= limit
+        fitting = [d for d in self.sample() if d.activeLoad <= limit]
+        order = self.order
+        if not fitting:
+            return None
+        return min(fitting, key=lambda d: (-priorityKey(d, self.usePFL, self.smoothing), order[d.name])).name
+
+
+class activeLoadIndex:
+    # Lazy-deletion min-heap over the ACL of every server, laid out like
+    # priorityIndex, so admission control knows in O(1) amortized whether
+    # any server has room. Entries are (ACL, order, version, server).
+
+
+    def __init__(self, servernames):
+        self.order = {name: i for i, name in enumerate(servernames)}
+        self.loads = {name: 0 for name in self.order}
+        self.versions = {name: 0 for name in self.order}
+        self.heap = []
+        self._compact()
+
+
+    def update(self, serverDetail):
+        server = serverDetail.name
+        version = self.versions[server] + 1
+        self.versions[server] = version
+        self.loads[server] = serverDetail.activeLoad
+        heapq.heappush(self.heap, (serverDetail.activeLoad, self.order[server], version, server))
+        if len(self.heap) > 2 * len(self.order) + 16:
+            self._compact()
+
+
+    def rebuild(self, serverDetails):
+        for server, serverDetail in serverDetails.items():
+            self.loads[server] = serverDetail.activeLoad
+            self.versions[server] += 1
+        self._compact()
+
+
+    def lowest(self):
+        # ACL of the least loaded server
+        heap = self.heap
+        versions = self.versions
+        while heap and heap[0][2] != versions[heap[0][3]]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else 0
+
+
+    def _compact(self):
+        self.heap = [(load, self.order[server], self.versions[server], server)
+                     for server, load in self.loads.items()]
+        heapq.heapify(self.heap)
+
+
+def makePriorityIndex(servernames, backend=HEAP_BACKEND, smoothing=PFL_SMOOTHING, sampleSize=SAMPLE_SIZE):
+    # the NumPy backend is optional, fall back to the heap without it
+    if backend == SAMPLED_BACKEND:
+        return sampledPriorityIndex(servernames, smoothing, sampleSize)
+    if backend == NUMPY_BACKEND and np is not None:
+        return numpyPriorityIndex(servernames, smoothing)
+    return priorityIndex(servernames, smoothing)
+
+
+class serverRecord:
+    # State of a single server. jobs, lastUpdateTime and servicePerJob are
+    # only used while the bandwidth is being estimated from a probe job.
+    __slots__ = (
+        "name",
+        "jobs",                # Jobs
+        "lastUpdateTime",      # LUT
+        "servicePerJob",       # service (us) received by every active job
+        "busyTime",            # time (us) with at least one active job
+        "numActiveJobs",       # NACJ
+        "activeLoad",          # ACL
+        "bandwidth",           # B
+        "bandwidthWeight",     # decayed number of completions B is averaged over
+        "bandwidthTime",       # time of the last B sample
+        "priority",            # P
+        "numAssignedJobs",     # NASJ
+        "assignedLoad",        # ASL
+        "estimatingBandwidth", # EB
+        "awaitingForceFeed",   # FF
+    )
+
+
+    def __init__(self, name, startTime, bandwidth=DB):
+        self.name = name
+        self.jobs = dict()
+        self.lastUpdateTime = startTime
+        self.servicePerJob = 0.0
+        self.busyTime = 0.0
+        self.numActiveJobs = 0
+        self.activeLoad = 0
+        self.bandwidth = bandwidth
+        self.bandwidthWeight = 0.0
+        self.bandwidthTime = startTime
+        self.priority = 0
+        self.numAssignedJobs = 0
+        self.assignedLoad = 0
+        self.estimatingBandwidth = True
+        self.awaitingForceFeed = True
+
+
+    def __repr__(self):
+        return str({slot: getattr(self, slot) for slot in self.__slots__[1:]})
+
+
+@policies.registerPolicy(PRIORITY_POLICY)
+class serverQueue(policies.schedulingPolicy):
+
+    def __init__(self, servernames, startTime, backend=HEAP_BACKEND, clock=time.monotonic,
+                 config=None, jctMetrics=None, mode=PRIORITY_MODE, sampleSize=SAMPLE_SIZE):
+        # clock returns the current time in seconds, startTime must come
+        # from the same clock. jctMetrics, e.g. a metrics.latencyHistogram,
+        # gets the time between getServer and removeJob of every job.
+        # mode picks the server with the highest P (PRIORITY_MODE) or the
+        # earliest predicted finish time of the job (FINISH_TIME_MODE).
+        # With SAMPLED_BACKEND both only compare sampleSize random servers.
+        super().__init__(servernames, startTime, clock, jctMetrics)
+        self.mode = mode
+        self.sampled = backend == SAMPLED_BACKEND
+        self.config = config if config is not None else schedulerConfig()
+        self.serverDetails = {name: serverRecord(name, startTime, self.config.defaultBandwidth)
+                              for name in servernames}
+        self.forceFeedQueue = deque(self.serverDetails.values())
+        self.numForceFed = 0
+        self.TFL = 0 # Total Finished Load
+        self.DL = self.config.defaultLoad  # Default Load
+        self.usePFL = False
+        self.index = makePriorityIndex(self.serverDetails.keys(), backend, self.config.pflSmoothing,
+                                       sampleSize)
+        # ACL order of the servers, only kept for admission control
+        self.loadIndex = None
+        if self.config.admissionLoad > 0 and not self.sampled:
+            self.loadIndex = activeLoadIndex(self.serverDetails.keys())
+        self._updatePs()
+        # admission control: held jobs per class, the load admitted per
+        # class divided by its weight, and the held jobs placed since the
+        # last takeReleased
+        self.heldJobs = defaultdict(deque)
+        self.numHeld = 0
+        self.classService = defaultdict(float)
+        self.released = []
+        self.topClassWeight = max(self.config.classWeights.values(), default=DEFAULT_CLASS_WEIGHT)
+        self.jobDetails = jobTable.jobTable(self.serverDetails)
+        self.numReapedJobs = 0
+        self.nextReapTime = startTime + self.config.jobTTL / REAPS_PER_TTL
+
+
+    def _findServerWithMostP(self):
+        return self.index.top()
+
+
+    def _findServerWithEarliestFinish(self, load):
+        # O(n) scan, ties go to the first server in servernames order. With
+        # SAMPLED_BACKEND only the d sampled servers are compared.
+        best = None
+        bestTime = float("inf")
+        candidates = self.index.sample() if self.sampled else self.serverDetails.values()
+        for serverDetail in candidates:
+            t = finishTime(serverDetail, load)
+            if t < bestTime:
+                best = serverDetail.name
+                bestTime = t
+        return best
+
+
     def _isUnknownJobSize(self, jobSize):
         return jobSize == '-1' or jobSize == -1.0
 
 
+    def _pflScale(self):
+        return 1 / self.TFL if self.usePFL else 1.0
+
+
     def _updatePs(self):
-        for server in self.serverDetails.keys():
-            divisor = max(1, self.serverDetails[server][ACL])
-            dividend = self.serverDetails[server][B]
-            self.serverDetails[server][P] = dividend / divisor
-            if self.TFL >= 1000:
-                finishedLoadForServer = self.serverDetails[server][ASL] - self.serverDetails[server][ACL]
-                self.serverDetails[server][P] *= (finishedLoadForServer + 0.1) / self.TFL
+        # recompute every priority, only needed when the formula changes
+        self.usePFL = self.TFL >= self.config.pflThreshold
+        self.index.rebuild(self.serverDetails, self.usePFL, self._pflScale())
+        if self.loadIndex is not None:
+            self.loadIndex.rebuild(self.serverDetails)
 
 
-    def _addJobToServerDetails(self, server, jobName, jobSize):
-        serverDetail = self.serverDetails[server]
-        load = self.DL if self._isUnknownJobSize(jobSize) else float(jobSize)
-        if EB not in serverDetail:
-            _ = self._updateNACJ(server, MODE_I)
-            _ = self._updateNASJ(server, MODE_I)
-            self._updateACL(server, MODE_I, load)
-            self._updateASL(server, MODE_I, load)
+    def _updateP(self, server):
+        # every change of a server's ACL ends here
+        if self.usePFL != (self.TFL >= self.config.pflThreshold):
             self._updatePs()
             return
-        else:
-            prevNACJ = self._updateNACJ(server, MODE_I)
-            _ = self._updateNASJ(server, MODE_I)
-            self._updateACL(server, MODE_I, load)
-            self._updateASL(server, MODE_I, load)
-            self._updatePs()
-            self._updateJ(server, prevNACJ)
-            if not self._isUnknownJobSize(jobSize):
-                serverDetail[J][jobName] = 0
+        self.index.rescale(self._pflScale())
+        self.index.update(self.serverDetails[server])
+        if self.loadIndex is not None:
+            self.loadIndex.update(self.serverDetails[server])
 
 
-    def _removeJobFromServerDetails(self, server, jobName, jobSize):
-        load = self.DL if self._isUnknownJobSize(jobSize) else float(jobSize)
-        if EB not in self.serverDetails[server]: # already know true BW
-            _ = self._updateNACJ(server, MODE_D)
-            self._updateACL(server, MODE_D, load)
-            self._updatePs()
-        elif self._isUnknownJobSize(jobSize):
-            prevNACJ = self._updateNACJ(server, MODE_D)
-            self._updateACL(server, MODE_D, load)
-            self._updateJ(server, prevNACJ)
-            self._updatePs()
-        else: # probe job
-            prevNACJ = self._updateNACJ(server, MODE_D)
-            self._updateACL(server, MODE_D, load)
-            self._updateJ(server, prevNACJ)
-            self._updateB(server, jobName, jobSize)
-            self._updatePs()
-            self._serverStopEB(server)
+    def _refreshPs(self):
+        for server, serverDetail in self.serverDetails.items():
+            serverDetail.priority = self.index.priority(server)
+
+
+    def _jobLoad(self, jobSize):
+        return self.DL if self._isUnknownJobSize(jobSize) else float(jobSize)
+
+
+    def _isTrackingJobs(self, serverDetail):
+        # stamps of known size jobs are needed to measure B
+        return serverDetail.estimatingBandwidth or self.config.bandwidthHalfLife > 0
 
 
-    def _increaseTFL(self, jobSize):
-        load = self.DL if self._isUnknownJobSize(jobSize) else float(jobSize)
+    def _addJobToServerDetails(self, server, jobName, jobSize, load):
+        serverDetail = self.serverDetails[server]
+        if not self._isTrackingJobs(serverDetail):
+            _ = self._updateNACJ(serverDetail, MODE_I)
+            _ = self._updateNASJ(serverDetail, MODE_I)
+            self._updateACL(serverDetail, MODE_I, load)
+            self._updateASL(serverDetail, MODE_I, load)
+            self._updateP(server)
+            return
+        else:
+            prevNACJ = self._updateNACJ(serverDetail, MODE_I)
+            _ = self._updateNASJ(serverDetail, MODE_I)
+            self._updateACL(serverDetail, MODE_I, load)
+            self._updateASL(serverDetail, MODE_I, load)
+            self._updateP(server)
+            self._updateJ(serverDetail, prevNACJ)
+            # unknown size jobs get a stamp too, a restore credits their
+            # service like any other job's
+            serverDetail.jobs[jobName] = serverDetail.servicePerJob
+
+
+    def _removeJobFromServerDetails(self, server, jobName, jobSize, load):
+        # load is the one counted when the job was added, DL may have moved
+        serverDetail = self.serverDetails[server]
+        if not self._isTrackingJobs(serverDetail): # already know true BW
+            _ = self._updateNACJ(serverDetail, MODE_D)
+            self._updateACL(serverDetail, MODE_D, load)
+            self._updateP(server)
+        elif self._isUnknownJobSize(jobSize):
+            prevNACJ = self._updateNACJ(serverDetail, MODE_D)
+            self._updateACL(serverDetail, MODE_D, load)
+            self._updateJ(serverDetail, prevNACJ)
+            serverDetail.jobs.pop(jobName, None)
+            self._updateP(server)
+        else: # probe job, or any known size job with a bandwidthHalfLife
+            prevNACJ = self._updateNACJ(serverDetail, MODE_D)
+            self._updateACL(serverDetail, MODE_D, load)
+            self._updateJ(serverDetail, prevNACJ)
+            self._updateB(serverDetail, jobName, jobSize)
+            self._updateP(server)
+            if serverDetail.estimatingBandwidth:
+                self._serverStopEB(serverDetail)
+
+
+    def _increaseTFL(self, load):
         self.TFL += load
 
 
-    def _addJobToJobDetails(self, server: str, jobName: str, jobSize: str) -> None:
-        self.jobDetails[jobName] = [server, float(jobSize)]
+    def _addJobToJobDetails(self, server: str, jobName: str, jobSize: str, load: float) -> None:
+        self.jobDetails.add(jobName, server, float(jobSize), load, self.clock())
 
 
-    def _removeJobFromJobDetails(self, jobName: str) -> Tuple[str, float]:
+    def _removeJobFromJobDetails(self, jobName: str) -> Tuple[str, float, float, float]:
          return self.jobDetails.pop(jobName)
 
 
@@ -133,62 +625,79 @@ class serverQueue:
             print(f"{k}:{v}")
 
 
-    def _serverStopEB(self, server):
-        serverDetail = self.serverDetails[server]
-        serverDetail.pop(J)
-        serverDetail.pop(LUT)
-        serverDetail.pop(EB)
-
-
-    def _updateJ(self, server, prevNACJ):
-        serverDetail = self.serverDetails[server]
-        lut = serverDetail[LUT]
-        now = datetime.now()
-        e = ((now - lut) / timedelta(microseconds=1))
-
-        for job in serverDetail[J].keys():
-            serverDetail[J][job] += e / prevNACJ
-        serverDetail[LUT] = now
-
-
-    def _updateB(self, server, jobName, jobSize):
-        serverDetail = self.serverDetails[server]
-        serverDetail[B] = round(jobSize / (serverDetail[J][jobName] / 1_000_000), 3)
-
-
-    def _updateACL(self, server, mode, load):
-        serverDetail = self.serverDetails[server]
+    def _serverStopEB(self, serverDetail):
+        serverDetail.estimatingBandwidth = False
+        if self.config.bandwidthHalfLife > 0:
+            return
+        serverDetail.jobs = None
+        serverDetail.lastUpdateTime = None
+
+
+    def _updateJ(self, serverDetail, prevNACJ):
+        # Processor sharing: every active job received e / prevNACJ of
+        # service since the last update. Jobs store servicePerJob at
+        # admission, so their elapsed service is a single subtraction.
+        lut = serverDetail.lastUpdateTime
+        now = self.clock()
+        e = (now - lut) * 1_000_000
+
+        if prevNACJ > 0:
+            serverDetail.servicePerJob += e / prevNACJ
+            serverDetail.busyTime += e
+        serverDetail.lastUpdateTime = now
+
+
+    def _updateB(self, serverDetail, jobName, jobSize):
+        # Average of the size / service time samples, each weighted by
+        # 0.5 ** (age / bandwidthHalfLife). Decaying the running weight
+        # keeps the update O(1); the first sample sets B on its own. Jobs
+        # restored from a snapshot without job tracking have no stamp.
+        stamp = serverDetail.jobs.pop(jobName, None)
+        if stamp is None:
+            return
+        elapsed = serverDetail.servicePerJob - stamp
+        if elapsed <= 0:
+            return
+        sample = jobSize / (elapsed / 1_000_000)
+        halfLife = self.config.bandwidthHalfLife
+        now = self.clock()
+        weight = 0.0
+        if halfLife > 0 and not serverDetail.estimatingBandwidth:
+            weight = serverDetail.bandwidthWeight * 0.5 ** ((now - serverDetail.bandwidthTime) / halfLife)
+        serverDetail.bandwidth = round((serverDetail.bandwidth * weight + sample) / (weight + 1), 3)
+        serverDetail.bandwidthWeight = weight + 1
+        serverDetail.bandwidthTime = now
+
+
+    def _updateACL(self, serverDetail, mode, load):
         if mode == MODE_D:
-            serverDetail[ACL] -= load
+            serverDetail.activeLoad -= load
         elif mode == MODE_I:
-            serverDetail[ACL] += load
+            serverDetail.activeLoad += load
 
 
-    def _updateASL(self, server, mode, load):
-        serverDetail = self.serverDetails[server]
+    def _updateASL(self, serverDetail, mode, load):
         if mode == MODE_D:
-            serverDetail[ASL] -= load
+            serverDetail.assignedLoad -= load
         elif mode == MODE_I:
-            serverDetail[ASL] += load
+            serverDetail.assignedLoad += load
 
 
-    def _updateNASJ(self, server, mode):
-        serverDetail = self.serverDetails[server]
-        prevNASJ = serverDetail[NASJ]
+    def _updateNASJ(self, serverDetail, mode):
+        prevNASJ = serverDetail.numAssignedJobs
         if mode == MODE_D:
-            serverDetail[NASJ] -= 1
+            serverDetail.numAssignedJobs -= 1
         elif mode == MODE_I:
-            serverDetail[NASJ] += 1
+            serverDetail.numAssignedJobs += 1
         return prevNASJ
 
 
-    def _updateNACJ(self, server, mode):
-        serverDetail = self.serverDetails[server]
-        prevNACJ = serverDetail[NACJ]
+    def _updateNACJ(self, serverDetail, mode):
+        prevNACJ = serverDetail.numActiveJobs
         if mode == MODE_D:
-            serverDetail[NACJ] -= 1
+            serverDetail.numActiveJobs -= 1
         elif mode == MODE_I:
-            serverDetail[NACJ] += 1
+            serverDetail.numActiveJobs += 1
         return prevNACJ
 
 
@@ -197,44 +706,434 @@ class serverQueue:
 
 
     def _forceFeed(self):
-        for server in self.serverDetails.keys():
-            if FF in self.serverDetails[server]:
-                self.numForceFed += 1
-                self.serverDetails[server].pop(FF)
-                return server
-        return None
+        # servers are force fed in servernames order, so the next one is
+        # always at the front of the queue
+        if not self.forceFeedQueue:
+            return None
+        serverDetail = self.forceFeedQueue.popleft()
+        serverDetail.awaitingForceFeed = False
+        self.numForceFed += 1
+        return serverDetail.name
+
+
+    def statusSnapshot(self, includeJobs=False):
+        # plain tuples, cheap to build and safe to format on another thread
+        servers = [(d.name, d.numActiveJobs, d.activeLoad, d.bandwidth, d.estimatingBandwidth)
+                   for d in self.serverDetails.values()]
+        counters = (("jobs", len(self.jobDetails)), ("held", self.numHeld), ("TFL", self.TFL),
+                    ("DL", self.DL), ("unknownCompletions", self.numUnknownCompletions),
+                    ("reaped", self.numReapedJobs))
+        if self.jctMetrics is not None:
+            counters += tuple((f"jct_{k}", v) for k, v in self.jctMetrics.summary())
+        jobs = list(self.jobDetails.items()) if includeJobs else []
+        return servers, counters, jobs
 
 
     def printServerStatus(self):
+        self._refreshPs()
         self._printServerDetails()
         self._printJobDetails()
 
 
-    def getServer(self, jobName, jobSize):
-        if self._hasForceFedAll() or self._isUnknownJobSize(jobSize):
-            server = self._findServerWithMost(P)
-        else:
-            server =  self._forceFeed()
-        self._addJobToServerDetails(server, jobName, jobSize)
-        self._addJobToJobDetails(server, jobName, jobSize)
-        return server
+    def chooseServer(self, jobName, jobSize):
+        # Each placement lowers the chosen server's P = B / ACL (its inverse
+        # drain time), so consecutive arrivals water-fill the servers.
+        self._updateDefaultLoad(jobSize)
+        if not (self._hasForceFedAll() or self._isUnknownJobSize(jobSize)):
+            return self._forceFeed()
+        if self.mode == FINISH_TIME_MODE:
+            return self._findServerWithEarliestFinish(self._jobLoad(jobSize))
+        return self._findServerWithMostP()
+
+
+    def onArrival(self, jobName, jobSize, server):
+        load = self._jobLoad(jobSize)
+        self._addJobToServerDetails(server, jobName, jobSize, load)
+        self._addJobToJobDetails(server, jobName, jobSize, load)
 
 
     def _updateDefaultLoad(self, jobSize):
-        if self._isUnknownJobSize(jobSize):
+        weight = self.config.loadWeight
+        if weight == 0 or self._isUnknownJobSize(jobSize):
             return
-        self.DL = 0.5 * self.DL + 0.5 * float(jobSize)
+        self.DL = (1 - weight) * self.DL + weight * float(jobSize)
+
+    def onCompletion(self, jobName):
+        server, jobSize, load, admitTime = self._removeJobFromJobDetails(jobName)
+        self._removeJobFromServerDetails(server, jobName, jobSize, load)
+        self._increaseTFL(load)
+        if self.jctMetrics is not None:
+            self.jctMetrics.add(self.clock() - admitTime)
+        return server, jobSize
+
 
     def removeJob(self, jobName):
-        server, jobSize = self._removeJobFromJobDetails(jobName)
-        self._removeJobFromServerDetails(server, jobName, jobSize)
-        self._increaseTFL(jobSize)
+        super().removeJob(jobName)
+        if self.numHeld:
+            self._releaseHeld()
+
+
+    def _classWeight(self, jobClass):
+        return self.config.classWeights.get(jobClass, DEFAULT_CLASS_WEIGHT)
+
+
+    def _admissionServer(self, load):
+        # The server an admitted job of a held back class goes to, None to
+        # hold it: the best server by the mode among those that would have
+        # at most admissionLoad active with the job, or are idle. Whether
+        # any server fits is O(1) amortized through loadIndex. The best one
+        # is found by walking the priority index down to the first server
+        # that fits, which is usually the top one. The finish time mode
+        # scans every server anyway. With SAMPLED_BACKEND only the d
+        # sampled servers are compared.
+        limit = max(0.0, self.config.admissionLoad - load)
+        if self.loadIndex is not None and self.loadIndex.lowest() > limit:
+            return None
+        if self.mode == PRIORITY_MODE:
+            return self.index.topWithin(self.serverDetails, limit)
+        candidates = self.index.sample() if self.sampled else self.serverDetails.values()
+        best = None
+        bestTime = float("inf")
+        for serverDetail in candidates:
+            if serverDetail.activeLoad <= limit:
+                t = finishTime(serverDetail, load)
+                if t < bestTime or best is None:
+                    best = serverDetail.name
+                    bestTime = t
+        return best
+
+
+    def _placeAdmitted(self, jobName, jobSize, server):
+        # getServer on the server picked by _admissionServer, probes of
+        # servers not force fed yet still go first
+        self._updateDefaultLoad(jobSize)
+        if not (self._hasForceFedAll() or self._isUnknownJobSize(jobSize)):
+            server = self._forceFeed()
+        self.onArrival(jobName, jobSize, server)
+        return server
+
+
+    def submitJob(self, jobName, jobSize, jobClass=DEFAULT_CLASS):
+        # getServer with admission control, None while the job is held
+        weight = self._classWeight(jobClass)
+        load = self._jobLoad(jobSize)
+        if weight >= self.topClassWeight:
+            self.classService[jobClass] += load / weight
+            return self.getServer(jobName, jobSize)
+        server = None if self.numHeld else self._admissionServer(load)
+        if server is None:
+            self.heldJobs[jobClass].append((jobName, jobSize, self.clock()))
+            self.numHeld += 1
+            return None
+        self.classService[jobClass] += load / weight
+        return self._placeAdmitted(jobName, jobSize, server)
+
+
+    def _releaseHeld(self):
+        # Weighted fair sharing: the class with the least admitted load per
+        # weight goes next, FIFO within a class. Stops at the first job that
+        # does not fit, so no class overtakes its turn.
+        heldJobs = self.heldJobs
+        while self.numHeld:
+            jobClass = min((c for c in heldJobs if heldJobs[c]), key=self.classService.__getitem__)
+            jobName, jobSize, arrivalTime = heldJobs[jobClass][0]
+            load = self._jobLoad(jobSize)
+            server = self._admissionServer(load)
+            if server is None:
+                return
+            heldJobs[jobClass].popleft()
+            self.numHeld -= 1
+            self.classService[jobClass] += load / self._classWeight(jobClass)
+            server = self._placeAdmitted(jobName, jobSize, server)
+            # the JCT counts the time the job was held
+            self.jobDetails.setAdmitTime(jobName, arrivalTime)
+            self.released.append((jobName, jobSize, server))
+
+
+    def takeReleased(self):
+        released = self.released
+        self.released = []
+        return released
+
+
+    def _reapJob(self, jobName):
+        # Drops a job whose completion never came: the server's NACJ, ACL,
+        # NASJ and ASL go back to what they were before the job, it does not
+        # count as finished load and gives no bandwidth sample. A completion
+        # arriving later is counted as unknown.
+        server, jobSize, load, _ = self._removeJobFromJobDetails(jobName)
+        serverDetail = self.serverDetails[server]
+        prevNACJ = self._updateNACJ(serverDetail, MODE_D)
+        _ = self._updateNASJ(serverDetail, MODE_D)
+        self._updateACL(serverDetail, MODE_D, load)
+        self._updateASL(serverDetail, MODE_D, load)
+        if self._isTrackingJobs(serverDetail):
+            self._updateJ(serverDetail, prevNACJ)
+            serverDetail.jobs.pop(jobName, None)
+        self._updateP(server)
+        self.numReapedJobs += 1
+
+
+    def reapJobs(self):
+        # At most every jobTTL / REAPS_PER_TTL seconds, O(peak jobs) per
+        # scan. The TTL runs from the placement, the time a job was held
+        # does not count. The freed load may let held jobs in.
+        ttl = self.config.jobTTL
+        now = self.clock()
+        if ttl <= 0 or now < self.nextReapTime:
+            return 0
+        self.nextReapTime = now + ttl / REAPS_PER_TTL
+        stale = self.jobDetails.placedBefore(now - ttl)
+        for jobName in stale:
+            self._reapJob(jobName)
+        if stale and self.numHeld:
+            self._releaseHeld()
+        return len(stale)
+
+
+    def assignBatch(self, requests, completions=()):
+        # requests are (jobName, jobSize) or (jobName, jobSize, jobClass).
+        # In FINISH_TIME_MODE the requests of a batch are placed largest
+        # first, like LPT scheduling: the big jobs take the servers where
+        # they finish first, the small ones fill in around them. P = B / ACL
+        # does not look at the job, there it only made the p95 worse, so
+        # PRIORITY_MODE keeps the arrival order.
+        for jobName in completions:
+            self.removeJob(jobName)
+        self.reapJobs()
+        if self.config.admissionLoad > 0:
+            return [self.submitJob(*request) for request in requests]
+        if self.mode != FINISH_TIME_MODE or len(requests) < 2:
+            return [self.getServer(request[0], request[1]) for request in requests]
+        servers = [None] * len(requests)
+        for i in sorted(range(len(requests)), key=lambda i: -self._jobLoad(requests[i][1])):
+            servers[i] = self.getServer(requests[i][0], requests[i][1])
+        return servers
+
+
+@policies.registerPolicy(FINISH_TIME_POLICY)
+class finishTimeQueue(serverQueue):
+    # serverQueue in FINISH_TIME_MODE
+
+
+    def __init__(self, servernames, startTime, backend=HEAP_BACKEND, clock=time.monotonic,
+                 config=None, jctMetrics=None, sampleSize=SAMPLE_SIZE):
+        super().__init__(servernames, startTime, backend, clock, config, jctMetrics, FINISH_TIME_MODE,
+                         sampleSize)
+
+
+class lineReader:
+    # Reads newline-terminated messages from the socket into one reusable
+    # buffer with recv_into. A line cut at a read boundary stays in the
+    # buffer and is completed by the next read instead of being dropped.
+    # A traceLog.traceWriter recorder gets the complete lines of every read.
+
+    COMPLETION = ord("F")
+
+
+    def __init__(self, sock, bufferSize=65536, recorder=None):
+        self.sock = sock
+        self.recorder = recorder
+        self.buffer = bytearray(bufferSize)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # first unparsed byte
+        self.end = 0    # end of received data
+
+
+    def _makeRoom(self):
+        if self.start > 0:
+            # move the partial line to the front of the buffer
+            pending = self.end - self.start
+            self.buffer[:pending] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = pending
+        else:
+            # a single line longer than the buffer
+            self.view.release()
+            self.buffer.extend(bytes(len(self.buffer)))
+            self.view = memoryview(self.buffer)
+
+
+    def readMessages(self):
+        # Returns the completed filenames and the "filename,jobsize" requests
+        # of every full line received so far, or None once the peer closed
+        # the connection. socket.timeout is raised like recv does.
+        if self.end == len(self.buffer):
+            self._makeRoom()
+        received = self.sock.recv_into(self.view[self.end:])
+        if received == 0:
+            return None
+        self.end += received
+
+        completions = []
+        requests = []
+        buffer = self.buffer
+        view = self.view
+        start = firstStart = self.start
+        newline = buffer.find(b"\n", start, self.end)
+        while newline != -1:
+            if newline > start:
+                if buffer[start] == self.COMPLETION:
+                    completions.append(str(view[start + 1:newline], "utf-8"))
+                else:
+                    requests.append(str(view[start:newline], "utf-8"))
+            start = newline + 1
+            newline = buffer.find(b"\n", start, self.end)
+        if self.recorder is not None and start > firstStart:
+            self.recorder.record(traceLog.INBOUND, view[firstStart:start])
+
+        if start == self.end:
+            self.start = self.end = 0
+        else:
+            self.start = start
+        return completions, requests
+
+
+# send the whole message even if the socket accepts only part of it
+def sendAll(serverSocket, data):
+    view = memoryview(data)
+    while view:
+        try:
+            sent = serverSocket.send(view)
+        except socket.timeout:
+            continue
+        view = view[sent:]
+
+
+class eventLoop:
+    # Waits in select() until a registered socket is readable or the next
+    # periodic task is due, so an idle scheduler does not use any CPU.
+
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.timers = []  # heap of (deadline, id, interval, callback)
+        self.running = False
+        # signals write a byte here, so a handler calling stop() also wakes
+        # up select() instead of waiting for the next message
+        self.wakeupReader, self.wakeupWriter = socket.socketpair()
+        self.wakeupReader.setblocking(False)
+        self.wakeupWriter.setblocking(False)
+        self.selector.register(self.wakeupReader, selectors.EVENT_READ, self._drainWakeup)
+
+
+    def addReader(self, sock, callback):
+        self.selector.register(sock, selectors.EVENT_READ, callback)
+
+
+    def addPeriodic(self, interval, callback):
+        deadline = time.monotonic() + interval
+        heapq.heappush(self.timers, (deadline, len(self.timers), interval, callback))
+
+
+    def stop(self):
+        self.running = False
+
+
+    def _drainWakeup(self):
+        try:
+            while self.wakeupReader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+
+    def _timeout(self):
+        if not self.timers:
+            return None
+        return max(0, self.timers[0][0] - time.monotonic())
+
+
+    def _runDueTimers(self):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            deadline, taskId, interval, callback = heapq.heappop(self.timers)
+            callback()
+            # skip missed periods instead of firing them back to back, a
+            # late timer waits a whole interval from now
+            nextDeadline = deadline + interval
+            if nextDeadline <= now:
+                nextDeadline = now + interval
+            heapq.heappush(self.timers, (nextDeadline, taskId, interval, callback))
 
 
+    def run(self):
+        self.running = True
+        previousWakeup = signal.set_wakeup_fd(self.wakeupWriter.fileno(), warn_on_full_buffer=False)
+        try:
+            while self.running:
+                for key, _ in self.selector.select(self._timeout()):
+                    key.data()
+                    if not self.running:
+                        break
+                if self.running:
+                    self._runDueTimers()
+        finally:
+            signal.set_wakeup_fd(previousWakeup)
+            self.selector.close()
+            self.wakeupReader.close()
+            self.wakeupWriter.close()
+
+
+logger = statusLogger.statusLogger()
+inst = instrumentation.instrumentation()
+instrumentFile = None
+snapshots = None
+recorder = None
+stopRequested = False
+loopRunning = False
+runningLoop = None
+
 # KeyboardInterrupt handler
+# Before the scheduling loop starts, e.g. while waiting in connect() or for
+# the servernames, there is nothing to save and it exits right away. Once
+# the loop runs the handler may run between any two lines of the
+# scheduler, so it only stops the loop; the last snapshot is taken once
+# the loop has returned.
 def sigint_handler(signal, frame):
+    global stopRequested
     print('KeyboardInterrupt is caught. Close all sockets :)')
-    sys.exit(0)
+    if not loopRunning:
+        sys.exit(0)
+    stopRequested = True
+    if runningLoop is not None:
+        runningLoop.stop()
+
+# hand the current state to the snapshot writer thread
+def takeSnapshot():
+    snapshots.submit(snapshot.captureState(sq))
+
+# write a last snapshot and wait for it
+def closeSnapshots():
+    if snapshots is None:
+        return
+    takeSnapshot()
+    snapshots.close()
+    if snapshots.error:
+        logger.warning("[JobScheduler] snapshot could not be written: {}", snapshots.error)
+
+# write out the buffered trace records
+def closeRecorder():
+    if recorder is None:
+        return
+    recorder.close()
+    logger.info("[JobScheduler] recorded {} trace records", recorder.numRecords)
+
+# write the instrumentation counters and timers to the file, or log them
+def exportInstrumentation():
+    if instrumentFile:
+        inst.dump(instrumentFile)
+    else:
+        logger.info("[JobScheduler] instrumentation {}", json.dumps(inst.snapshot()))
+
+# SIGUSR1: export an instrumentation snapshot
+def sigusr1_handler(signal, frame):
+    exportInstrumentation()
+
+# SIGUSR2: turn instrumentation on or off
+def sigusr2_handler(signal, frame):
+    inst.toggle(sq)
+    logger.info("[JobScheduler] instrumentation {}", "on" if inst.enabled else "off")
 
 # send trigger to printAll at servers
 def sendPrintAll(serverSocket):
@@ -255,7 +1154,7 @@ def getCompletedFilename(filename):
     # server?                                          #
     ####################################################
     sq.removeJob(filename)
-    print(f"[JobScheduler] Filename {filename} is finished.")
+    logger.debug("[JobScheduler] Filename {} is finished.", filename)
 
 
 # formatting: to assign server to the request
@@ -263,7 +1162,7 @@ def scheduleJobToServer(servername, request):
     return (servername + "," + request + "\n").encode()
 
 # main part you need to do
-def assignServerToRequest(servernames, request, sq):
+def assignServersToRequests(servernames, requests, sq):
     ####################################################
     #                      TODO                        #
     # Given the list of servers, which server you want #
@@ -271,51 +1170,178 @@ def assignServerToRequest(servernames, request, sq):
     # You can use a global variables or add more       #
     # arguments.                                       #
 
-    request_name = request.split(",")[0]
-    request_size = request.split(",")[1]
-    server_to_send = sq.getServer(request_name, request_size)
+    # all requests of a chunk are placed together, "filename,size" or
+    # "filename,size,class"
+    fields = [request.split(",") for request in requests]
+    servers_to_send = sq.assignBatch(fields)
 
     ####################################################
 
-    # Schedule the job
-    scheduled_request = scheduleJobToServer(server_to_send, request)
-    return scheduled_request
+    # Schedule the jobs, building the whole message with a single join.
+    # Servers only get "filename,size", held jobs (None) are sent once
+    # released.
+    lines = [scheduleJobToServer(server, f"{jobName},{jobSize}")
+             for jobName, jobSize, server in sq.takeReleased()]
+    lines += [scheduleJobToServer(server, request if len(field) == 2 else f"{field[0]},{field[1]}")
+              for server, request, field in zip(servers_to_send, requests, fields) if server is not None]
+    return b"".join(lines)
+
+
+# send the jobs a policy placed between two chunks, e.g. from the replies
+# of a sharded front-end
+def sendReleased(serverSocket, sq):
+    sendToServers = b"".join(scheduleJobToServer(server, f"{jobName},{jobSize}")
+                             for jobName, jobSize, server in sq.takeReleased())
+    if sendToServers != b"":
+        sendAll(serverSocket, sendToServers)
+        if recorder is not None:
+            recorder.record(traceLog.OUTBOUND, sendToServers)
 
 
-def parseThenSendRequest(clientData, serverSocket, servernames, sq):
-    # print received requests
-    print(f"*******************")
-    print(f"[JobScheduler] Received binary messages:\n{clientData}\n")
+def parseThenSendRequest(completions, requests, serverSocket, servernames, sq):
+    # log received requests
+    logger.debug("[JobScheduler] Received messages:\ncompleted: {}\nrequests: {}",
+                 completions, requests)
 
-    # parsing to "filename, jobsize" pairs
-    requests = clientData.decode().split("\n")[:-1]
-    sendToServers = b""
-    for request in requests:
-        if request[0] == "F":
-            # if completed filenames, get the message with leading alphabet "F"
-            filename = request.replace("F", "")
-            getCompletedFilename(filename)
-        else:
-            # if requests, add "servername" front of the pairs -> "servername, filename, jobsize"
-            sendToServers = sendToServers + \
-                assignServerToRequest(servernames, request, sq)
+    # completed filenames (leading alphabet "F" already stripped by the
+    # reader) are applied before any request of the chunk is placed
+    for filename in completions:
+        getCompletedFilename(filename)
+
+    # if requests, add "servername" front of the pairs -> "servername, filename, jobsize"
+    sendToServers = assignServersToRequests(servernames, requests, sq)
 
     # send "servername, filename, jobsize" pairs to servers
     if sendToServers != b"":
-        serverSocket.send(sendToServers)
+        sendAll(serverSocket, sendToServers)
+        if recorder is not None:
+            recorder.record(traceLog.OUTBOUND, sendToServers)
+
+    if logger.statusDue():
+        logger.logStatus(sq.statusSnapshot(logger.isEnabledFor(statusLogger.DEBUG)))
+
+# receive one chunk of messages and schedule it, False once the server closed
+def receiveThenSchedule(reader, serverSocket, servernames, sq):
+    # receive the completed filenames from server
+    messages = reader.readMessages()
+    if messages is None:
+        logger.info("[JobScheduler] Connection closed by server.")
+        return False
+    completions, requests = messages
+    if completions or requests:
+        parseThenSendRequest(
+            completions, requests, serverSocket, servernames, sq)
+    return True
+
+
+def runPollLoop(reader, serverSocket, servernames, sq):
+    global loopRunning
+    # IMPORTANT: for 50ms granularity of emulator
+    serverSocket.settimeout(0.0001)
+
+    now = datetime.now()
+    currSeconds = -1
+    loopRunning = True
+    try:
+        while not stopRequested:
+            try:
+                if not receiveThenSchedule(reader, serverSocket, servernames, sq):
+                    break
+            except socket.timeout:
+
+                # IMPORTANT: catch timeout exception, DO NOT REMOVE
+                pass
+
+            # Example printAll API : let servers print status in every seconds
+            # if (datetime.now() - now).seconds > currSeconds:
+            #     currSeconds = currSeconds + 1
+            #     sendPrintAll(serverSocket)
+    finally:
+        loopRunning = False
+
+
+def runEventLoop(reader, serverSocket, servernames, sq, printAllInterval=None, periodicTasks=(), readers=()):
+    # the socket stays blocking, recv is only called once select() reports
+    # it readable. readers are more (file, callback) pairs to watch.
+    global loopRunning, runningLoop
+    serverSocket.settimeout(None)
+    loop = eventLoop()
+
+    def onReadable():
+        if not receiveThenSchedule(reader, serverSocket, servernames, sq):
+            loop.stop()
+
+    loop.addReader(serverSocket, onReadable)
+    for file, callback in readers:
+        loop.addReader(file, callback)
+    if printAllInterval:
+        # let servers print status periodically
+        loop.addPeriodic(printAllInterval, lambda: sendPrintAll(serverSocket))
+    for interval, callback in periodicTasks:
+        loop.addPeriodic(interval, callback)
+    runningLoop = loop
+    loopRunning = True
+    try:
+        if not stopRequested:
+            loop.run()
+    finally:
+        loopRunning = False
+        runningLoop = None
 
-    sq.printServerStatus()
-    print(f"--------------------")
 
 if __name__ == "__main__":
     # catch the KeyboardInterrupt error in Python
     signal.signal(signal.SIGINT, sigint_handler)
+    signal.signal(signal.SIGUSR1, sigusr1_handler)
+    signal.signal(signal.SIGUSR2, sigusr2_handler)
 
     # parse arguments and get port number
     parser = argparse.ArgumentParser(description="JobScheduler.")
     parser.add_argument('-port', '--server_port', action='store', type=str, required=True,
                         help='port to server/client')
+    parser.add_argument('-backend', '--backend', action='store', default=HEAP_BACKEND,
+                        choices=[HEAP_BACKEND, NUMPY_BACKEND, SAMPLED_BACKEND],
+                        help='data structure used to find the server with the highest priority')
+    parser.add_argument('-sampleSize', '--sample_size', action='store', type=int, default=SAMPLE_SIZE,
+                        help=f'servers compared per decision by the {SAMPLED_BACKEND} backend')
+    parser.add_argument('-policy', '--policy', action='store', default=PRIORITY_POLICY,
+                        choices=sorted(policies.POLICIES),
+                        help='placement policy, see policies.py (-backend and -config only apply to '
+                             f'{PRIORITY_POLICY} and {FINISH_TIME_POLICY})')
+    parser.add_argument('-loop', '--loop', action='store', default=SELECT_LOOP,
+                        choices=[SELECT_LOOP, POLL_LOOP],
+                        help='wait for messages with select() or by polling with a 0.1ms timeout')
+    parser.add_argument('-printAll', '--print_all_interval', action='store', type=float, default=None,
+                        help='seconds between printAll triggers sent to the servers (select loop only)')
+    parser.add_argument('-config', '--config', action='store', default=None,
+                        help='JSON file overriding the scheduler constants (see schedulerConfig)')
+    parser.add_argument('-instrument', '--instrument', action='store_true',
+                        help='time the scheduler from the start (SIGUSR2 toggles it at runtime)')
+    parser.add_argument('-instrumentFile', '--instrument_file', action='store', default=None,
+                        help='file the instrumentation snapshots are appended to (SIGUSR1 writes one)')
+    parser.add_argument('-instrumentInterval', '--instrument_interval', action='store', type=float,
+                        default=None, help='seconds between two snapshots (select loop only)')
+    parser.add_argument('-snapshot', '--snapshot', action='store', default=None,
+                        help='file the scheduler state is saved to periodically and on exit')
+    parser.add_argument('-snapshotInterval', '--snapshot_interval', action='store', type=float,
+                        default=1.0, help='seconds between two snapshots (select loop only)')
+    parser.add_argument('-restore', '--restore', action='store_true',
+                        help='start from the state in the -snapshot file if there is one')
+    parser.add_argument('-record', '--record', action='store', default=None,
+                        help='file every message and assignment is logged to, see replay.py')
+    parser.add_argument('-logLevel', '--log_level', action='store', default="info",
+                        choices=list(statusLogger.LEVELS),
+                        help='debug also logs every message and the in-flight jobs')
+    parser.add_argument('-logInterval', '--log_interval', action='store', type=float, default=1.0,
+                        help='minimum seconds between two server status snapshots')
     args = parser.parse_args()
+    if args.restore and not args.snapshot:
+        parser.error("-restore needs -snapshot")
+    if args.snapshot and not issubclass(policies.POLICIES[args.policy], serverQueue):
+        parser.error(f"-snapshot only applies to {PRIORITY_POLICY} and {FINISH_TIME_POLICY}")
+    logger.level = statusLogger.LEVELS[args.log_level]
+    logger.interval = args.log_interval
+    instrumentFile = args.instrument_file
     server_port = int(args.server_port)
 
     # open socket to servers
@@ -323,29 +1349,49 @@ if __name__ == "__main__":
     serverSocket.connect(('127.0.0.1', server_port))
 
     # IMPORTANT: for 50ms granularity of emulator
-    serverSocket.settimeout(0.0001)
+    if args.loop == POLL_LOOP:
+        serverSocket.settimeout(0.0001)
 
     # receive preliminary information: servernames (can infer the number of servers)
     binaryServernames = serverSocket.recv(4096)
     servernames = parseServernames(binaryServernames)
+    if args.record:
+        recorder = traceLog.traceWriter(args.record)
+        recorder.record(traceLog.SERVERNAMES, binaryServernames)
     print(f"Servernames: {servernames}")
 
-    currSeconds = -1
-    now = datetime.now()
-    sq = serverQueue(servernames, now)
-    while (True):
-        try:
-            # receive the completed filenames from server
-            completeFilenames = serverSocket.recv(4096)
-            if completeFilenames != b"":
-                parseThenSendRequest(
-                    completeFilenames, serverSocket, servernames, sq)
-        except socket.timeout:
-
-            # IMPORTANT: catch timeout exception, DO NOT REMOVE
-            pass
-
-        # Example printAll API : let servers print status in every seconds
-        # if (datetime.now() - now).seconds > currSeconds:
-        #     currSeconds = currSeconds + 1
-        #     sendPrintAll(serverSocket)
+    now = time.monotonic()
+    config = schedulerConfig.fromFile(args.config) if args.config else schedulerConfig()
+    options = {"jctMetrics": metrics.latencyHistogram()}
+    if issubclass(policies.POLICIES[args.policy], serverQueue):
+        options.update(backend=args.backend, config=config, sampleSize=args.sample_size)
+    sq = policies.makePolicy(args.policy, servernames, now, **options)
+    if args.restore and os.path.exists(args.snapshot):
+        state = snapshot.loadState(args.snapshot)
+        if state["config"] != config.asDict():
+            logger.warning("[JobScheduler] the snapshot was taken with {}, restoring it with {}",
+                           state["config"], config.asDict())
+        numServers, numJobs, numCompleted = snapshot.restoreState(sq, state)
+        logger.info("[JobScheduler] restored {} servers and {} in-flight jobs, {} of them finished "
+                    "while the scheduler was down", numServers, numJobs, numCompleted)
+    if args.snapshot:
+        snapshots = snapshot.snapshotWriter(args.snapshot)
+    if args.instrument:
+        inst.attach(sq)
+    reader = lineReader(serverSocket, recorder=recorder)
+    if args.loop == POLL_LOOP:
+        runPollLoop(reader, serverSocket, servernames, sq)
+    else:
+        periodicTasks = []
+        if args.instrument_interval:
+            periodicTasks.append((args.instrument_interval, exportInstrumentation))
+        if snapshots is not None:
+            periodicTasks.append((args.snapshot_interval, takeSnapshot))
+        if recorder is not None:
+            periodicTasks.append((1.0, recorder.flush))
+        runEventLoop(reader, serverSocket, servernames, sq, args.print_all_interval, periodicTasks)
+    if inst.enabled:
+        exportInstrumentation()
+    closeSnapshots()
+    closeRecorder()
+    logger.close()
@@ -0,0 +1,105 @@
+import math
+from array import array
+
+
+class jobTable:
+    # In-flight jobs of a serverQueue as fixed-width columns instead of a
+    # [server, size, load, admitTime] list per job. Every job gets an
+    # integer slot, servers are stored by their index in servernames, and
+    # the slots of finished jobs are reused through a free list, so the
+    # table never grows past the peak number of jobs in flight. Reads like
+    # a dict of jobName -> (server, size, load, admitTime) tuples. The time
+    # a job was placed on its server is kept apart from admitTime, which
+    # starts its JCT and may be earlier for a job that was held back.
+
+
+    def __init__(self, servernames):
+        self.servernames = list(servernames)
+        self.serverIds = {name: i for i, name in enumerate(self.servernames)}
+        self.slots = {}  # jobName -> slot
+        self.names = []  # slot -> jobName, None for a free slot
+        self.servers = array("i")
+        self.sizes = array("d")
+        self.loads = array("d")
+        self.admitTimes = array("d")
+        self.placedTimes = array("d")  # inf for a free slot
+        self.freeSlots = []
+
+
+    def __len__(self):
+        return len(self.slots)
+
+
+    def __contains__(self, jobName):
+        return jobName in self.slots
+
+
+    def __iter__(self):
+        return iter(self.slots)
+
+
+    def add(self, jobName, server, jobSize, load, admitTime):
+        # a name that is already in flight is overwritten, like a dict would
+        slot = self.slots.get(jobName)
+        if slot is None:
+            if self.freeSlots:
+                slot = self.freeSlots.pop()
+                self.names[slot] = jobName
+            else:
+                slot = len(self.names)
+                self.names.append(jobName)
+                self.servers.append(0)
+                self.sizes.append(0.0)
+                self.loads.append(0.0)
+                self.admitTimes.append(0.0)
+                self.placedTimes.append(0.0)
+            self.slots[jobName] = slot
+        self.servers[slot] = self.serverIds[server]
+        self.sizes[slot] = jobSize
+        self.loads[slot] = load
+        self.admitTimes[slot] = admitTime
+        self.placedTimes[slot] = admitTime
+
+
+    def __setitem__(self, jobName, record):
+        self.add(jobName, *record)
+
+
+    def _record(self, slot):
+        return self.servernames[self.servers[slot]], self.sizes[slot], self.loads[slot], self.admitTimes[slot]
+
+
+    def __getitem__(self, jobName):
+        return self._record(self.slots[jobName])
+
+
+    def pop(self, jobName):
+        slot = self.slots.pop(jobName)
+        record = self._record(slot)
+        self.names[slot] = None
+        self.placedTimes[slot] = math.inf
+        self.freeSlots.append(slot)
+        return record
+
+
+    def setAdmitTime(self, jobName, admitTime):
+        self.admitTimes[self.slots[jobName]] = admitTime
+
+
+    def placedTime(self, jobName):
+        return self.placedTimes[self.slots[jobName]]
+
+
+    def setPlacedTime(self, jobName, placedTime):
+        self.placedTimes[self.slots[jobName]] = placedTime
+
+
+    def items(self):
+        record = self._record
+        return ((jobName, record(slot)) for jobName, slot in self.slots.items())
+
+
+    def placedBefore(self, cutoff):
+        # names of the jobs placed before cutoff, one pass over a column
+        names = self.names
+        return [names[slot] for slot, placedTime in enumerate(self.placedTimes) if placedTime < cutoff]
@@ -0,0 +1,87 @@
+import math
+
+
+class latencyHistogram:
+    # HDR-style histogram with logarithmic buckets: bucket i > 0 holds the
+    # values in [minValue * g^(i-1), minValue * g^i) with g = 1 + precision,
+    # so every percentile is within `precision` of the exact one and memory
+    # only grows with the log of the value range, not with the count.
+
+
+    def __init__(self, precision=0.01, minValue=0.001):
+        self.minValue = minValue
+        self.logGrowth = math.log1p(precision)
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+
+    def _bucket(self, value):
+        if value < self.minValue:
+            return 0
+        return int(math.log(value / self.minValue) / self.logGrowth) + 1
+
+
+    def _bucketValue(self, bucket):
+        # geometric middle of the bucket
+        if bucket == 0:
+            return 0.0
+        return self.minValue * math.exp((bucket - 0.5) * self.logGrowth)
+
+
+    def add(self, value):
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+    def _valueAt(self, rank):
+        # the rank-th smallest value (from 1), up to the bucket precision
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(max(self._bucketValue(bucket), self.min), self.max)
+        return self.max
+
+
+    def percentile(self, percentile):
+        # same rank as my_percentile in s.py: the (floor(n * p / 100) + 1)-th value
+        if self.count == 0:
+            return None
+        return self._valueAt(min(self.count, math.floor(self.count * percentile / 100) + 1))
+
+
+    def median(self):
+        # like statistics.median: the mean of the two middle values for an
+        # even count, where percentile(50) is the upper one
+        if self.count == 0:
+            return None
+        if self.count % 2 == 1:
+            return self._valueAt(self.count // 2 + 1)
+        return (self._valueAt(self.count // 2) + self._valueAt(self.count // 2 + 1)) / 2
+
+
+    def summary(self):
+        return (("count", self.count), ("mean", self.mean()), ("p50", self.percentile(50)),
+                ("p95", self.percentile(95)), ("p99", self.percentile(99)))
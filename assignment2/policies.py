@@ -0,0 +1,206 @@
+import itertools
+import random
+import time
+
+UNKNOWN_SIZE = "-1"
+DEFAULT_LOAD = 200.0  # load assumed for a job of unknown size, like DL in jobScheduler.py
+
+# name -> policy class, filled by registerPolicy
+POLICIES = {}
+
+
+def registerPolicy(name):
+    # class decorator: makes the policy selectable by name, e.g. with
+    # jobScheduler.py -policy
+    def register(cls):
+        POLICIES[name] = cls
+        return cls
+    return register
+
+
+def makePolicy(name, servernames, startTime, **options):
+    if name not in POLICIES:
+        raise ValueError(f"unknown policy {name!r}, expected one of {sorted(POLICIES)}")
+    return POLICIES[name](servernames, startTime, **options)
+
+
+def isUnknownJobSize(jobSize):
+    return jobSize == UNKNOWN_SIZE or jobSize == -1.0
+
+
+class schedulingPolicy:
+    # Base of the placement policies. The I/O loop of jobScheduler.py and
+    # the simulator only call getServer, removeJob, assignBatch and
+    # statusSnapshot, which are built from three hooks:
+    #   chooseServer(jobName, jobSize) picks the server of an arriving job,
+    #   onArrival(jobName, jobSize, server) records the placement,
+    #   onCompletion(jobName) forgets a finished job.
+    # chooseServer is called exactly once per arrival, right before
+    # onArrival, so it may consume state like a force feed queue.
+
+
+    def __init__(self, servernames, startTime, clock=time.monotonic, jctMetrics=None):
+        self.servernames = list(servernames)
+        self.startTime = startTime
+        self.clock = clock
+        self.jctMetrics = jctMetrics
+        self.jobDetails = {}
+        self.numUnknownCompletions = 0
+
+
+    def chooseServer(self, jobName, jobSize):
+        raise NotImplementedError
+
+
+    def onArrival(self, jobName, jobSize, server):
+        self.jobDetails[jobName] = (server, jobSize, self.clock())
+
+
+    def onCompletion(self, jobName):
+        server, jobSize, admitTime = self.jobDetails.pop(jobName)
+        if self.jctMetrics is not None:
+            self.jctMetrics.add(self.clock() - admitTime)
+        return server, jobSize
+
+
+    def getServer(self, jobName, jobSize):
+        server = self.chooseServer(jobName, jobSize)
+        self.onArrival(jobName, jobSize, server)
+        return server
+
+
+    def removeJob(self, jobName):
+        # completions of jobs this process never placed, e.g. ones placed
+        # after the snapshot it was restored from, are ignored
+        if jobName not in self.jobDetails:
+            self.numUnknownCompletions += 1
+            return
+        self.onCompletion(jobName)
+
+
+    def assignBatch(self, requests, completions=()):
+        # completions received in the same chunk are applied first, a class
+        # field after the size is ignored
+        for jobName in completions:
+            self.removeJob(jobName)
+        return [self.getServer(request[0], request[1]) for request in requests]
+
+
+    def takeReleased(self):
+        # (jobName, jobSize, server) of jobs placed after assignBatch
+        # returned None for them, only for policies that hold jobs back
+        return []
+
+
+    def _serverStatus(self):
+        # (name, NACJ, ACL, B, EB) like serverQueue, B and EB are unknown
+        numActiveJobs = dict.fromkeys(self.servernames, 0)
+        activeLoad = dict.fromkeys(self.servernames, 0.0)
+        for server, jobSize, _ in self.jobDetails.values():
+            numActiveJobs[server] += 1
+            activeLoad[server] += DEFAULT_LOAD if isUnknownJobSize(jobSize) else float(jobSize)
+        return [(name, numActiveJobs[name], activeLoad[name], None, None) for name in self.servernames]
+
+
+    def statusSnapshot(self, includeJobs=False):
+        counters = (("policy", type(self).__name__), ("jobs", len(self.jobDetails)),
+                    ("unknownCompletions", self.numUnknownCompletions))
+        if self.jctMetrics is not None:
+            counters += tuple((f"jct_{k}", v) for k, v in self.jctMetrics.summary())
+        jobs = [(k, v) for k, v in self.jobDetails.items()] if includeJobs else []
+        return self._serverStatus(), counters, jobs
+
+
+    def printServerStatus(self):
+        for name, numActiveJobs, activeLoad, _, _ in self._serverStatus():
+            print(f"{name}:{{'numActiveJobs': {numActiveJobs}, 'activeLoad': {activeLoad}}}")
+        for k, v in self.jobDetails.items():
+            print(f"{k}:{v}")
+
+
+@registerPolicy("first")
+class firstServerPolicy(schedulingPolicy):
+    # every job goes to the first server, the policy of the original template
+
+
+    def chooseServer(self, jobName, jobSize):
+        return self.servernames[0]
+
+
+@registerPolicy("roundRobin")
+class roundRobinPolicy(schedulingPolicy):
+
+
+    def __init__(self, servernames, startTime, clock=time.monotonic, jctMetrics=None):
+        super().__init__(servernames, startTime, clock, jctMetrics)
+        self.nextServer = itertools.cycle(self.servernames)
+
+
+    def chooseServer(self, jobName, jobSize):
+        return next(self.nextServer)
+
+
+@registerPolicy("random")
+class randomPolicy(schedulingPolicy):
+
+
+    def __init__(self, servernames, startTime, clock=time.monotonic, jctMetrics=None, seed=None):
+        super().__init__(servernames, startTime, clock, jctMetrics)
+        self.rnd = random.Random(seed)
+
+
+    def chooseServer(self, jobName, jobSize):
+        return self.rnd.choice(self.servernames)
+
+
+@registerPolicy("leastLoaded")
+class leastLoadedPolicy(schedulingPolicy):
+    # Server with the least active load, counting DEFAULT_LOAD for jobs of
+    # unknown size. Ignores bandwidth, unlike the priority policy. Ties go
+    # to the first server in servernames order.
+
+
+    def __init__(self, servernames, startTime, clock=time.monotonic, jctMetrics=None,
+                 defaultLoad=DEFAULT_LOAD):
+        super().__init__(servernames, startTime, clock, jctMetrics)
+        self.defaultLoad = defaultLoad
+        self.activeLoad = dict.fromkeys(self.servernames, 0.0)
+
+
+    def _jobLoad(self, jobSize):
+        return self.defaultLoad if isUnknownJobSize(jobSize) else float(jobSize)
+
+
+    def chooseServer(self, jobName, jobSize):
+        return min(self.servernames, key=self.activeLoad.__getitem__)
+
+
+    def onArrival(self, jobName, jobSize, server):
+        super().onArrival(jobName, jobSize, server)
+        self.activeLoad[server] += self._jobLoad(jobSize)
+
+
+    def onCompletion(self, jobName):
+        server, jobSize = super().onCompletion(jobName)
+        self.activeLoad[server] -= self._jobLoad(jobSize)
+        return server, jobSize
+
+
+@registerPolicy("powerOfTwo")
+class powerOfTwoPolicy(leastLoadedPolicy):
+    # less loaded of two servers sampled at random, O(1) per job
+
+
+    def __init__(self, servernames, startTime, clock=time.monotonic, jctMetrics=None,
+                 defaultLoad=DEFAULT_LOAD, seed=None):
+        super().__init__(servernames, startTime, clock, jctMetrics, defaultLoad)
+        self.rnd = random.Random(seed)
+
+
+    def chooseServer(self, jobName, jobSize):
+        if len(self.servernames) < 2:
+            return self.servernames[0]
+        first, second = self.rnd.sample(self.servernames, 2)
+        if self.activeLoad[second] < self.activeLoad[first]:
+            return second
+        return first
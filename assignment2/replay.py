@@ -0,0 +1,135 @@
+import argparse
+import random
+import time
+
+from emulator import readServerConfig
+import jobScheduler
+from jobScheduler import (DL, HEAP_BACKEND, NUMPY_BACKEND, PRIORITY_POLICY, SAMPLE_SIZE, SAMPLED_BACKEND,
+                          schedulerConfig, serverQueue)
+import metrics
+import policies
+import s
+from simulator import simulate, virtualClock
+import traceLog
+
+
+def replayQueue(path, makeQueue, speed=0.0):
+    # Feeds every recorded chunk to a new scheduler through the functions
+    # of the I/O loop, on a clock that follows the trace. speed 1 keeps the
+    # recorded gaps between chunks, 10 replays ten times faster, 0 as fast
+    # as possible. The completions are the recorded ones, so the replay
+    # measures the cost of the decisions and how many of the recorded
+    # assignments the scheduler repeats, not their JCT.
+    clock = virtualClock()
+    latency = metrics.latencyHistogram(precision=0.02, minValue=1)
+    perfCounter = time.perf_counter_ns
+    recorded = {}
+    replayed = {}
+    sq = None
+    servernames = []
+    start = None
+    numChunks = 0
+    numDecisions = 0
+    wallStart = time.monotonic()
+    for timeNs, kind, payload in traceLog.readTrace(path):
+        if start is None:
+            start = timeNs
+        clock.now = (timeNs - start) / 1e9
+        if kind == traceLog.SERVERNAMES:
+            servernames = jobScheduler.parseServernames(payload)
+            sq = makeQueue(servernames, clock.now, clock)
+        elif kind == traceLog.OUTBOUND:
+            recorded.update(traceLog.parseOutbound(payload))
+        elif kind == traceLog.INBOUND and sq is not None:
+            if speed > 0:
+                delay = wallStart + clock.now / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            completions, requests = traceLog.parseInbound(payload)
+            chunkStart = perfCounter()
+            for filename in completions:
+                sq.removeJob(filename)
+            sent = jobScheduler.assignServersToRequests(servernames, requests, sq)
+            latency.add((perfCounter() - chunkStart) / max(1, len(completions) + len(requests)))
+            replayed.update(traceLog.parseOutbound(sent))
+            numChunks += 1
+            numDecisions += len(completions) + len(requests)
+    common = [filename for filename in replayed if filename in recorded]
+    same = sum(recorded[filename] == replayed[filename] for filename in common)
+    return {"chunks": numChunks, "decisions": numDecisions, "seconds": time.monotonic() - wallStart,
+            "p50_ns": latency.percentile(50), "p99_ns": latency.percentile(99),
+            "agreement": same / len(common) if common else 1.0}
+
+
+def traceRequests(path):
+    # servernames and (time, filename, size as sent) of every request, the
+    # times relative to the first record
+    servernames = []
+    requests = []
+    start = None
+    for timeNs, kind, payload in traceLog.readTrace(path):
+        if start is None:
+            start = timeNs
+        if kind == traceLog.SERVERNAMES:
+            servernames = jobScheduler.parseServernames(payload)
+        elif kind == traceLog.INBOUND:
+            for request in traceLog.parseInbound(payload)[1]:
+                filename, size = request.split(",")[:2]
+                requests.append(((timeNs - start) / 1e9, filename, size))
+    return servernames, requests
+
+
+def simulateTrace(path, servers, makeQueue, seed=0, tick=0.05):
+    # (p50, p95) JCT of the recorded arrivals on emulated servers. A trace
+    # does not hold the true size of a "-1" request, it is drawn from the
+    # known sizes of the same trace (DL without any).
+    _, recorded = traceRequests(path)
+    known = [float(size) for _, _, size in recorded if not policies.isUnknownJobSize(size)]
+    rnd = random.Random(seed)
+    requests = []
+    for ts, filename, size in recorded:
+        if policies.isUnknownJobSize(size):
+            requests.append((ts, filename, rnd.choice(known) if known else DL))
+        else:
+            requests.append((ts, filename, float(size)))
+    sentSizes = {filename: size for _, filename, size in recorded}
+    tsBegin, tsComplete = simulate(requests, servers, seed=seed, tick=tick, makeQueue=makeQueue,
+                                   sentSizes=sentSizes)
+    return s.calcStat(s.calcJCTs(tsBegin, tsComplete))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a trace recorded with jobScheduler.py -record.")
+    parser.add_argument('trace', help='trace file')
+    parser.add_argument('--speed', dest="speed", type=float, default=0.0,
+                        help='1 replays at the recorded pace, 10 ten times faster, 0 as fast as possible')
+    parser.add_argument('--simulate', dest="serverConfig",
+                        help='config_server file: run the recorded arrivals on emulated servers instead')
+    parser.add_argument('--tick', dest="tick", type=float, default=0.05,
+                        help='seconds between completion checks of the emulated servers')
+    parser.add_argument('--seed', dest="seed", type=int, default=0, help='seed for the sizes of -1 requests')
+    parser.add_argument('--policy', dest="policy", default=PRIORITY_POLICY,
+                        choices=sorted(policies.POLICIES), help='placement policy, see policies.py')
+    parser.add_argument('--backend', dest="backend", default=HEAP_BACKEND,
+                        choices=[HEAP_BACKEND, NUMPY_BACKEND, SAMPLED_BACKEND],
+                        help='priority backend of the serverQueue policies')
+    parser.add_argument('--d', dest="sampleSize", type=int, default=SAMPLE_SIZE,
+                        help=f'servers compared per decision by the {SAMPLED_BACKEND} backend')
+    parser.add_argument('--config', dest="config", help='JSON file with schedulerConfig fields')
+    args = parser.parse_args()
+
+    options = {}
+    if issubclass(policies.POLICIES[args.policy], serverQueue):
+        options.update(backend=args.backend, sampleSize=args.sampleSize)
+        if args.config:
+            options.update(config=schedulerConfig.fromFile(args.config))
+    makeQueue = lambda names, startTime, clk: policies.makePolicy(args.policy, names, startTime,
+                                                                  clock=clk, **options)
+    if args.serverConfig:
+        p50, p95 = simulateTrace(args.trace, readServerConfig(args.serverConfig), makeQueue, args.seed,
+                                 args.tick)
+        print(f"p50: {p50}\np95: {p95}")
+    else:
+        result = replayQueue(args.trace, makeQueue, args.speed)
+        for k, v in result.items():
+            print(f"{k}: {v}")
@@ -3,32 +3,40 @@ import pickle
 import shlex
 import time
 import os
+import shutil
+import socket
+import tempfile
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import statistics
 import math
 import argparse
+import sys
+
+import metrics
 
 NUM_TESTCASES = 8
 CLIENT_PICKLE = "client.pickle"
 SERVER_PICKLE = "server.pickle"
+CONFIG_CLIENT = "config_client"
+CONFIG_SERVER = "config_server"
+SERVER_CLIENT = "server_client"
 READ_BINARY_MODE = "rb"
-MUTE = False
-def my_percentile(data, percentile):
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TESTCASES_DIR = os.path.join(SCRIPT_DIR, "testcases")
+EMULATOR_PATH = os.path.join(SCRIPT_DIR, "emulator.py")
+SCHEDULER_PATH = os.path.join(SCRIPT_DIR, "jobScheduler.py")
+PROC_NET_TCP = ["/proc/net/tcp", "/proc/net/tcp6"]
+READY_TIMEOUT = 30
+def my_percentile(data, percentile, is_sorted=False):
     n = len(data)
     p = n * percentile / 100
+    if not is_sorted:
+        data = sorted(data)
     if p.is_integer():
-        return sorted(data)[int(p)]
+        return data[int(p)]
     else:
-        return sorted(data)[int(math.ceil(p)) - 1]
-
-def portGenerator():
-    port = 12454
-
-    def nextPort():
-        nonlocal port
-        port += 1
-        return port
-    return nextPort
+        return data[int(math.ceil(p)) - 1]
 
 def loadPickle(filename):
     with open(filename, READ_BINARY_MODE) as file:
@@ -43,10 +51,27 @@ def calcJCTs(map_ts_begin, map_ts_complete):
     return list_tsdiff
 
 def calcStat(list_tsdiff):
-    p50 = statistics.median(list_tsdiff)
-    p95 = my_percentile(list_tsdiff, 95)
+    # sort once for both percentiles
+    data = sorted(list_tsdiff)
+    n = len(data)
+    p50 = data[n // 2] if n % 2 == 1 else (data[n // 2 - 1] + data[n // 2]) / 2
+    p95 = my_percentile(data, 95, is_sorted=True)
     return p50, p95
 
+def calcSketchStat(map_ts_begin, map_ts_complete):
+    # p50 (the median, like calcStat) and p95 from a histogram instead of a
+    # sorted JCT list. The two maps are still loaded whole: a pickled dict
+    # cannot be read incrementally, so only the JCT list and the float
+    # copies of loadPickle are saved.
+    histogram = metrics.latencyHistogram()
+    for filename, begin in map_ts_begin.items():
+        histogram.add(round(2 * (float(map_ts_complete[filename]) - float(begin)), 1)/2.0)
+    return histogram.median(), histogram.percentile(95)
+
+def loadRawPickle(filename):
+    with open(filename, READ_BINARY_MODE) as file:
+        return pickle.load(file)
+
 def processPickles(tcDir):
     map_ts_begin = loadPickle(os.path.join(tcDir, CLIENT_PICKLE))
     map_ts_complete = loadPickle(os.path.join(tcDir, SERVER_PICKLE))
@@ -67,87 +92,113 @@ def printStat(avgTimings, start, stat):
     for k in keys:
         print(f'{k}: {avgTimings[k]}')
 
-def removePickles(path_to_client_pickle, path_to_server_pickle):
-    if os.path.exists(path_to_client_pickle):
-        os.remove(path_to_client_pickle)
-    if os.path.exists(path_to_server_pickle):
-        os.remove(path_to_server_pickle)
-
-def startScheduler(tcDir, getNextPort, prob):
+def findFreePort():
+    # let the OS pick a port that is free right now
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def isListening(port):
+    # LISTEN sockets (state 0A) in /proc/net/tcp, local address is ip:port in hex
+    for path in PROC_NET_TCP:
+        if not os.path.exists(path):
+            continue
+        with open(path) as table:
+            next(table)
+            for line in table:
+                fields = line.split()
+                if fields[3] == "0A" and int(fields[1].split(":")[1], 16) == port:
+                    return True
+    return False
+
+def waitUntilListening(port, process, timeout=READY_TIMEOUT):
+    if not any(os.path.exists(path) for path in PROC_NET_TCP):
+        # cannot see the sockets, fall back to the old fixed wait
+        time.sleep(2)
+        return
+    deadline = time.monotonic() + timeout
+    while not isListening(port):
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode} before listening on {port}")
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"server is not listening on {port} after {timeout}s")
+        time.sleep(0.01)
+
+def prepareWorkDir(tcDir):
+    # private copy of the testcase so parallel runs do not share pickles
+    workDir = tempfile.mkdtemp(prefix=f"tc{os.path.basename(tcDir)}_")
+    for filename in (CONFIG_CLIENT, CONFIG_SERVER):
+        shutil.copy(os.path.join(tcDir, filename), workDir)
+    binary = os.path.join(tcDir, SERVER_CLIENT)
+    if os.path.exists(binary):
+        os.symlink(os.path.abspath(binary), os.path.join(workDir, SERVER_CLIENT))
+    return workDir
+
+def startScheduler(tcDir, port, prob, mute=False, emulator=False):
     print(f"***Start test in {tcDir}, prob={prob}")
-    port = getNextPort()
     print(f"Using port: {port}")
-    command = f"./server_client -port {port} -prob {prob}"
-    sc = subprocess.Popen(command, shell=True, stdout=subprocess.DEVNULL, cwd=tcDir)
-    time.sleep(2)
+    if emulator:
+        command = f"{sys.executable} {EMULATOR_PATH} -port {port} -prob {prob}"
+    else:
+        command = f"./{SERVER_CLIENT} -port {port} -prob {prob}"
+    sc = subprocess.Popen(shlex.split(command), stdout=subprocess.DEVNULL, cwd=tcDir)
+    waitUntilListening(port, sc)
 
-    command = f"/usr/bin/python3 jobScheduler.py -port {port}"
-    if MUTE:
+    command = f"{sys.executable} {SCHEDULER_PATH} -port {port}"
+    if mute:
         scheduler = subprocess.Popen(shlex.split(command), stdout=subprocess.DEVNULL)
     else:
         scheduler = subprocess.Popen(shlex.split(command))
 
-    while sc.poll() is None:
-        time.sleep(2)
+    sc.wait()
     scheduler.terminate()
+    scheduler.wait()
     print(f"***End test in {tcDir}")
 
+def runTestcase(tcIndex, prob, mute=False, emulator=False, sketch=False):
+    workDir = prepareWorkDir(os.path.join(TESTCASES_DIR, str(tcIndex)))
+    try:
+        startScheduler(workDir, findFreePort(), prob, mute, emulator)
+        if sketch:
+            p50, p95 = calcSketchStat(loadRawPickle(os.path.join(workDir, CLIENT_PICKLE)),
+                                      loadRawPickle(os.path.join(workDir, SERVER_PICKLE)))
+        else:
+            p50, p95 = calcStat(processPickles(workDir))
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+    return tcIndex, prob, p50, p95
+
+def runMatrix(tcIndices, probs, workers, mute=False, emulator=False, sketch=False):
+    stat = defaultdict(list)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(runTestcase, tcIndex, prob, mute, emulator, sketch)
+                   for prob in probs for tcIndex in tcIndices]
+        # collected in submission order so the lists are ordered by testcase
+        for future in futures:
+            tcIndex, prob, p50, p95 = future.result()
+            stat[f'prob{str(prob).zfill(3)}_p50s'].append(p50)
+            stat[f'prob{str(prob).zfill(3)}_p95s'].append(p95)
+    return stat
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--t', dest="tci", type=int, help='testcase index')
     parser.add_argument('--p', dest="prob", type=int, help='probability')
     parser.add_argument('--m', dest="mute", action='store_true', help='mute')
+    parser.add_argument('--e', dest="emulator", action='store_true',
+                        help='use emulator.py instead of the server_client binary')
+    parser.add_argument('--s', dest="sketch", action='store_true',
+                        help='compute the percentiles with a histogram instead of a sorted JCT list '
+                             '(the pickles are still loaded whole)')
+    parser.add_argument('--j', dest="workers", type=int, default=os.cpu_count(),
+                        help='number of testcases run in parallel')
     args = parser.parse_args()
 
-    stat = defaultdict(list)
-    getNextPort = portGenerator()
     start = time.time()
-
-    MUTE = args.mute
-    tcIndex = args.tci
-    prob = args.prob
-    if tcIndex is not None and prob is not None:
-        tcDir = f"/home/y/yaofengw/assignment2/testcases/{tcIndex}"
-        path_to_client_pickle = os.path.join(tcDir, CLIENT_PICKLE)
-        path_to_server_pickle = os.path.join(tcDir, SERVER_PICKLE)
-        removePickles(path_to_client_pickle, path_to_server_pickle)
-        startScheduler(tcDir, getNextPort, prob)
-        list_tsdiff = processPickles(tcDir)
-        p50, p95 = calcStat(list_tsdiff)
-        stat[f'prob{str(prob).zfill(3)}_p50s'].append(p50)
-        stat[f'prob{str(prob).zfill(3)}_p95s'].append(p95)
-        removePickles(path_to_client_pickle, path_to_server_pickle)
-        avgTimings = calcAverageStat(stat)
-        printStat(avgTimings, start, stat)
-    elif prob is not None:
-        for tcIndex in range(NUM_TESTCASES):
-            tcDir = f"/home/y/yaofengw/assignment2/testcases/{tcIndex}"
-            path_to_client_pickle = os.path.join(tcDir, CLIENT_PICKLE)
-            path_to_server_pickle = os.path.join(tcDir, SERVER_PICKLE)
-            removePickles(path_to_client_pickle, path_to_server_pickle)
-            startScheduler(tcDir, getNextPort, prob)
-            list_tsdiff = processPickles(tcDir)
-            p50, p95 = calcStat(list_tsdiff)
-            stat[f'prob{str(prob).zfill(3)}_p50s'].append(p50)
-            stat[f'prob{str(prob).zfill(3)}_p95s'].append(p95)
-            removePickles(path_to_client_pickle, path_to_server_pickle)
-        avgTimings = calcAverageStat(stat)
-        printStat(avgTimings, start, stat)
-    else:
-        for prob in [0, 50, 100]:
-            for tcIndex in range(NUM_TESTCASES):
-                tcDir = f"/home/y/yaofengw/assignment2/testcases/{tcIndex}"
-                path_to_client_pickle = os.path.join(tcDir, CLIENT_PICKLE)
-                path_to_server_pickle = os.path.join(tcDir, SERVER_PICKLE)
-                removePickles(path_to_client_pickle, path_to_server_pickle)
-                startScheduler(tcDir, getNextPort, prob)
-                list_tsdiff = processPickles(tcDir)
-                p50, p95 = calcStat(list_tsdiff)
-                stat[f'prob{str(prob).zfill(3)}_p50s'].append(p50)
-                stat[f'prob{str(prob).zfill(3)}_p95s'].append(p95)
-                removePickles(path_to_client_pickle, path_to_server_pickle)
-        avgTimings = calcAverageStat(stat)
-        printStat(avgTimings, start, stat)
-
-
+    tcIndices = [args.tci] if args.tci is not None else \
+        [i for i in range(NUM_TESTCASES) if os.path.isdir(os.path.join(TESTCASES_DIR, str(i)))]
+    probs = [0, 50, 100] if args.prob is None else [args.prob]
+    stat = runMatrix(tcIndices, probs, args.workers, args.mute, args.emulator, args.sketch)
+    avgTimings = calcAverageStat(stat)
+    printStat(avgTimings, start, stat)
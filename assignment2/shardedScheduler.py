@@ -0,0 +1,290 @@
+import argparse
+from collections import deque
+import math
+import multiprocessing
+import signal
+import socket
+import time
+
+import jobScheduler
+from jobScheduler import (DL, HEAP_BACKEND, NUMPY_BACKEND, PFL_THRESHOLD, PRIORITY_POLICY, SAMPLED_BACKEND,
+                          serverQueue)
+import metrics
+import policies
+from simulator import virtualClock
+
+# requests a shard may have unanswered. Their replies stay well below the
+# pipe buffer, so a shard never blocks on a reply while the front-end
+# blocks on sending it the next batch.
+PIPELINE_JOBS = 1024
+
+
+def setOtherTFL(sq, pflThreshold, otherTFL):
+    # P includes PFL once the TFL of all shards reaches pflThreshold, a
+    # shard's own TFL would give keys other shards cannot compare with. The
+    # shard's threshold is lowered by the finished load of the others. A
+    # shard without any finished load keeps the plain B / ACL, which orders
+    # its servers like PFL (0 everywhere) and avoids the 1 / TFL scale.
+    threshold = max(math.ulp(0.0), pflThreshold - otherTFL)
+    if sq.config.pflThreshold != threshold:
+        sq.config.pflThreshold = threshold
+        if sq.usePFL != (sq.TFL >= threshold):
+            sq._updatePs()
+
+
+def shardSummary(sq, pflThreshold=PFL_THRESHOLD, otherTFL=0.0):
+    # (key, ACL, servers awaiting a force feed, TFL, usePFL) of the shard's
+    # best server: the front-end sends an arrival to the shard with the
+    # highest key. Every shard orders its servers by the same formula, so
+    # with one job per batch it picks the same server as a single queue.
+    # Policies without a priority index report their number of jobs.
+    # The key leaves out the 1 / TFL factor, common to every server.
+    if not isinstance(sq, serverQueue):
+        return 1 / (1 + len(sq.jobDetails)), 0.0, 0, 0.0, False
+    usePFL = sq.TFL + otherTFL >= pflThreshold
+    server = sq.index.top() if sq.mode == jobScheduler.PRIORITY_MODE else None
+    if server is None:
+        return 1 / (1 + len(sq.jobDetails)), 0.0, len(sq.forceFeedQueue), sq.TFL, usePFL
+    serverDetail = sq.serverDetails[server]
+    key = jobScheduler.priorityKey(serverDetail, usePFL, sq.config.pflSmoothing)
+    return key, serverDetail.activeLoad, len(sq.forceFeedQueue), sq.TFL, usePFL
+
+
+def shardWorker(conn, policy, servernames, startTime, options):
+    # One scheduler process: a batch of (time, TFL of the other shards,
+    # completions, requests) in, the chosen servers and the new summary out. The shard
+    # runs on the front-end's clock, so all shards agree on time and the
+    # simulator can drive them.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    clock = virtualClock()
+    clock.now = startTime
+    sq = policies.makePolicy(policy, servernames, startTime, clock=clock, **options)
+    isServerQueue = isinstance(sq, serverQueue)
+    pflThreshold = sq.config.pflThreshold if isServerQueue else PFL_THRESHOLD
+    conn.send(shardSummary(sq, pflThreshold))
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        clock.now, otherTFL, completions, requests = message
+        if isServerQueue:
+            setOtherTFL(sq, pflThreshold, otherTFL)
+        servers = sq.assignBatch(requests, completions)
+        conn.send((servers, shardSummary(sq, pflThreshold, otherTFL)))
+    conn.close()
+
+
+class shardedQueue:
+    # Front-end of N scheduler processes that own disjoint sets of servers.
+    # It has the getServer/removeJob/assignBatch interface of a policy, so
+    # the jobScheduler.py I/O loop drives it unchanged. Completions are
+    # buffered and sent to the shard that placed the job together with the
+    # next batch. assignBatch does not wait for the shards: it returns None
+    # for every request, and the placements come back through
+    # takeReleased like jobs held by admission control. The front-end
+    # routes the next chunk while the shards still work on the last one;
+    # the conns of readers() become readable when a reply is waiting.
+    # pipeline=False waits for the replies in assignBatch, for callers like
+    # simulator.py that start the jobs at the time of their batch.
+
+
+    def __init__(self, servernames, startTime, numShards=2, policy=PRIORITY_POLICY, clock=time.monotonic,
+                 jctMetrics=None, defaultLoad=DL, pipeline=True, **options):
+        servernames = list(servernames)
+        numShards = max(1, min(numShards, len(servernames)))
+        self.clock = clock
+        self.pipeline = pipeline
+        self.jctMetrics = jctMetrics
+        self.defaultLoad = defaultLoad
+        self.jobShards = {}  # jobName -> (shard, admitTime)
+        self.pendingCompletions = [[] for _ in range(numShards)]
+        self.numUnknownCompletions = 0
+        # per shard, the requests of every batch without a reply yet
+        self.unanswered = [deque() for _ in range(numShards)]
+        self.numUnanswered = [0] * numShards
+        self.released = []
+        config = options.get("config")
+        self.pflThreshold = config.pflThreshold if config is not None else PFL_THRESHOLD
+        context = multiprocessing.get_context("spawn")
+        self.conns = []
+        self.workers = []
+        for shard in range(numShards):
+            conn, workerConn = context.Pipe()
+            worker = context.Process(target=shardWorker, daemon=True,
+                                     args=(workerConn, policy, servernames[shard::numShards], startTime,
+                                           options))
+            worker.start()
+            self.conns.append(conn)
+            self.workers.append(worker)
+        self.summaries = [list(conn.recv()) for conn in self.conns]
+
+
+    def _jobLoad(self, jobSize):
+        return self.defaultLoad if policies.isUnknownJobSize(jobSize) else float(jobSize)
+
+
+    def _chooseShard(self, jobSize):
+        # known sizes go to shards that still have servers to force feed
+        summaries = self.summaries
+        if not policies.isUnknownJobSize(jobSize):
+            for shard, summary in enumerate(summaries):
+                if summary[2] > 0:
+                    summary[2] -= 1
+                    return shard
+        shard = max(range(len(summaries)), key=lambda i: summaries[i][0])
+        # the shard's best server gets the job, its key drops like P = B / ACL
+        summary = summaries[shard]
+        load = self._jobLoad(jobSize)
+        summary[0] *= max(1, summary[1]) / max(1, summary[1] + load)
+        summary[1] += load
+        return shard
+
+
+    def getServer(self, jobName, jobSize):
+        # waits for the reply, so the job is not released a second time
+        self.assignBatch([(jobName, jobSize)])
+        self.flush()
+        for i in range(len(self.released) - 1, -1, -1):
+            if self.released[i][0] == jobName:
+                return self.released.pop(i)[2]
+        return None
+
+
+    def removeJob(self, jobName):
+        entry = self.jobShards.pop(jobName, None)
+        if entry is None:
+            self.numUnknownCompletions += 1
+            return
+        shard, admitTime = entry
+        self.pendingCompletions[shard].append(jobName)
+        if self.jctMetrics is not None:
+            self.jctMetrics.add(self.clock() - admitTime)
+
+
+    def assignBatch(self, requests, completions=()):
+        for jobName in completions:
+            self.removeJob(jobName)
+        self.collect()
+        numShards = len(self.conns)
+        batches = [[] for _ in range(numShards)]
+        now = self.clock()
+        # class fields are dropped, admission control needs a global view
+        for jobName, jobSize, *_ in requests:
+            shard = self._chooseShard(jobSize)
+            batches[shard].append((jobName, jobSize))
+            self.jobShards[jobName] = (shard, now)
+
+        # a shard also refreshes its key when the formula of P changed
+        # since its last summary
+        totalTFL = sum(summary[3] for summary in self.summaries)
+        usePFL = totalTFL >= self.pflThreshold
+        for shard in range(numShards):
+            batch = batches[shard]
+            stale = self.summaries[shard][4] != usePFL and not self.unanswered[shard]
+            if not (batch or self.pendingCompletions[shard] or stale):
+                continue
+            while self.unanswered[shard] and self.numUnanswered[shard] + len(batch) > PIPELINE_JOBS:
+                self._receive(shard)
+            self.conns[shard].send((now, totalTFL - self.summaries[shard][3], self.pendingCompletions[shard],
+                                    batch))
+            self.pendingCompletions[shard] = []
+            self.unanswered[shard].append(batch)
+            self.numUnanswered[shard] += len(batch)
+        if not self.pipeline:
+            self.flush()
+        return [None] * len(requests)
+
+
+    def _receive(self, shard):
+        # the oldest reply of the shard, blocks until it is there
+        servers, summary = self.conns[shard].recv()
+        batch = self.unanswered[shard].popleft()
+        self.numUnanswered[shard] -= len(batch)
+        self.summaries[shard] = list(summary)
+        self.released.extend((jobName, jobSize, server) for (jobName, jobSize), server in zip(batch, servers))
+
+
+    def collect(self):
+        # the replies that have arrived, without waiting
+        for shard, conn in enumerate(self.conns):
+            while self.unanswered[shard] and conn.poll():
+                self._receive(shard)
+
+
+    def flush(self):
+        # waits for every reply
+        for shard in range(len(self.conns)):
+            while self.unanswered[shard]:
+                self._receive(shard)
+
+
+    def readers(self):
+        return list(self.conns)
+
+
+    def statusSnapshot(self, includeJobs=False):
+        counters = (("shards", len(self.conns)), ("jobs", len(self.jobShards)),
+                    ("unknownCompletions", self.numUnknownCompletions))
+        if self.jctMetrics is not None:
+            counters += tuple((f"jct_{k}", v) for k, v in self.jctMetrics.summary())
+        jobs = [(k, v) for k, v in self.jobShards.items()] if includeJobs else []
+        return [], counters, jobs
+
+
+    def takeReleased(self):
+        self.collect()
+        released = self.released
+        self.released = []
+        return released
+
+
+    def printServerStatus(self):
+        for k, v in self.jobShards.items():
+            print(f"{k}:{v}")
+
+
+    def close(self):
+        self.flush()
+        for conn in self.conns:
+            conn.send(None)
+        for worker in self.workers:
+            worker.join()
+        self.conns = []
+        self.workers = []
+
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGINT, jobScheduler.sigint_handler)
+
+    parser = argparse.ArgumentParser(description="JobScheduler with the servers split across processes.")
+    parser.add_argument('-port', '--server_port', action='store', type=str, required=True,
+                        help='port to server/client')
+    parser.add_argument('-shards', '--shards', action='store', type=int, default=multiprocessing.cpu_count(),
+                        help='number of scheduler processes')
+    parser.add_argument('-policy', '--policy', action='store', default=PRIORITY_POLICY,
+                        choices=sorted(policies.POLICIES), help='placement policy of every shard')
+    parser.add_argument('-backend', '--backend', action='store', default=HEAP_BACKEND,
+                        choices=[HEAP_BACKEND, NUMPY_BACKEND, SAMPLED_BACKEND],
+                        help='priority backend of the serverQueue policies')
+    args = parser.parse_args()
+
+    serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    serverSocket.connect(('127.0.0.1', int(args.server_port)))
+    servernames = jobScheduler.parseServernames(serverSocket.recv(4096))
+    print(f"Servernames: {servernames}")
+
+    options = {}
+    if issubclass(policies.POLICIES[args.policy], serverQueue):
+        options["backend"] = args.backend
+    sq = shardedQueue(servernames, time.monotonic(), args.shards, args.policy,
+                      jctMetrics=metrics.latencyHistogram(), **options)
+    # getCompletedFilename of jobScheduler.py completes jobs on its global sq
+    jobScheduler.sq = sq
+    # placements are sent as soon as a shard replies
+    shardReaders = [(conn, lambda: jobScheduler.sendReleased(serverSocket, sq)) for conn in sq.readers()]
+    try:
+        jobScheduler.runEventLoop(jobScheduler.lineReader(serverSocket), serverSocket, servernames, sq,
+                                  readers=shardReaders)
+    finally:
+        sq.close()
+        jobScheduler.logger.close()
@@ -0,0 +1,236 @@
+import argparse
+import heapq
+import math
+import os
+import random
+import time
+from collections import defaultdict
+
+from emulator import (CONFIG_CLIENT, CONFIG_SERVER, UNKNOWN_SIZE, formatSize,
+                      processorSharingServer, readClientConfig, readServerConfig)
+from jobScheduler import (HEAP_BACKEND, NUMPY_BACKEND, PRIORITY_POLICY, SAMPLE_SIZE, SAMPLED_BACKEND,
+                          schedulerConfig, serverQueue)
+import policies
+import s
+
+TESTCASES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testcases")
+PROBS = [0, 50, 100]
+
+HIGH_CLASS = "high"
+LOW_CLASS = "low"
+
+
+class virtualClock:
+    # injected into serverQueue in place of the wall clock
+
+
+    def __init__(self):
+        self.now = 0.0
+
+
+    def __call__(self):
+        return self.now
+
+
+def listTestcases(testcasesDir=TESTCASES_DIR):
+    return sorted((name for name in os.listdir(testcasesDir)
+                   if os.path.isfile(os.path.join(testcasesDir, name, CONFIG_CLIENT))), key=int)
+
+
+def loadTestcase(tcDir):
+    return (readClientConfig(os.path.join(tcDir, CONFIG_CLIENT)),
+            readServerConfig(os.path.join(tcDir, CONFIG_SERVER)))
+
+
+def hideSizes(requests, prob, seed=0):
+    # (time, filename, size as sent to the scheduler), -1 with prob %
+    rnd = random.Random(seed)
+    return [(ts, filename, UNKNOWN_SIZE if rnd.random() * 100 < prob else formatSize(size))
+            for ts, filename, size in requests]
+
+
+def noticeTime(completionTime, tick):
+    # first multiple of tick at or after completionTime
+    noticed = math.ceil(completionTime / tick) * tick
+    if noticed < completionTime:
+        noticed += tick
+    return noticed
+
+
+def assignClasses(requests, highShare, seed=0):
+    # filename -> HIGH_CLASS for a random highShare of the files, LOW_CLASS
+    # for the rest
+    rnd = random.Random(seed)
+    return {filename: HIGH_CLASS if rnd.random() < highShare else LOW_CLASS
+            for _, filename, _ in requests}
+
+
+def slowdownFastest(requests, servers, factor):
+    # (time, servername, bandwidth): the fastest server drops to factor of
+    # its bandwidth halfway through the arrivals
+    if not requests:
+        return []
+    name, bandwidth = max(servers, key=lambda s: s[1])
+    middle = (requests[0][0] + requests[-1][0]) / 2
+    return [(middle, name, bandwidth * factor)]
+
+
+def simulate(requests, servers, prob=0, seed=0, tick=0.05, makeQueue=None, bandwidthChanges=(),
+             classes=None, sentSizes=None):
+    # Runs the trace on processor-sharing servers and returns the begin and
+    # complete timestamps of every file, like client.pickle/server.pickle.
+    # Completions are noticed on the next multiple of tick, like the
+    # emulator; tick=0 notices them at the exact completion time.
+    # makeQueue(servernames, startTime, clock) builds the scheduler.
+    # bandwidthChanges is a list of (time, servername, new bandwidth).
+    # classes maps filenames to the class field of their request, held
+    # jobs start on the server once the scheduler releases them.
+    # sentSizes maps filenames to the size sent to the scheduler, in place
+    # of hiding prob % of the sizes, e.g. the sizes of a recorded trace.
+    clock = virtualClock()
+    servernames = [name for name, _ in servers]
+    if makeQueue is None:
+        makeQueue = lambda names, startTime, clk: serverQueue(names, startTime, clock=clk)
+    sq = makeQueue(servernames, clock.now, clock)
+
+    psServers = {name: processorSharingServer(name, bandwidth) for name, bandwidth in servers}
+    sizes = {filename: size for _, filename, size in requests}
+    if sentSizes is None:
+        arrivals = sorted(hideSizes(requests, prob, seed), key=lambda r: r[0])
+    else:
+        arrivals = sorted(((ts, filename, sentSizes[filename]) for ts, filename, _ in requests),
+                          key=lambda r: r[0])
+
+    # heap of (completion time, servername, version), stale when the
+    # server changed after the entry was pushed
+    completions = []
+    versions = dict.fromkeys(psServers, 0)
+
+    def pushCompletion(name):
+        versions[name] += 1
+        completionTime = psServers[name].nextCompletionTime()
+        if completionTime is not None:
+            if tick:
+                completionTime = noticeTime(completionTime, tick)
+            heapq.heappush(completions, (completionTime, name, versions[name]))
+
+    def nextCompletionTime():
+        while completions and completions[0][2] != versions[completions[0][1]]:
+            heapq.heappop(completions)
+        return completions[0][0] if completions else math.inf
+
+    changes = sorted(bandwidthChanges)
+    tsBegin = {}
+    tsComplete = {}
+    nextArrival = 0
+    nextChange = 0
+    while nextArrival < len(arrivals) or nextCompletionTime() < math.inf:
+        arrivalTime = arrivals[nextArrival][0] if nextArrival < len(arrivals) else math.inf
+        changeTime = changes[nextChange][0] if nextChange < len(changes) else math.inf
+        now = min(arrivalTime, nextCompletionTime(), changeTime)
+        clock.now = now
+
+        finished = []
+        changed = set()
+        while nextCompletionTime() <= now:
+            _, name, _ = heapq.heappop(completions)
+            for filename, _ in psServers[name].complete(now):
+                finished.append(filename)
+                tsComplete[filename] = now
+            changed.add(name)
+
+        while nextChange < len(changes) and changes[nextChange][0] <= now:
+            _, name, bandwidth = changes[nextChange]
+            psServers[name].setBandwidth(bandwidth, now)
+            changed.add(name)
+            nextChange += 1
+
+        batch = []
+        while nextArrival < len(arrivals) and arrivals[nextArrival][0] <= now:
+            _, filename, size = arrivals[nextArrival]
+            batch.append((filename, size) if classes is None else (filename, size, classes[filename]))
+            tsBegin[filename] = now
+            nextArrival += 1
+
+        assigned = sq.assignBatch(batch, finished)
+        placed = [(request[0], name) for request, name in zip(batch, assigned) if name is not None]
+        placed += [(filename, name) for filename, _, name in sq.takeReleased()]
+        for filename, name in placed:
+            psServers[name].add(filename, sizes[filename], now)
+            changed.add(name)
+        for name in changed:
+            pushCompletion(name)
+    return tsBegin, tsComplete
+
+
+def runTestcase(tcDir, prob, seed=0, tick=0.05, makeQueue=None, slowdown=None, highShare=None):
+    # {class: (p50, p95)}, None is every file
+    requests, servers = loadTestcase(tcDir)
+    changes = slowdownFastest(requests, servers, slowdown) if slowdown is not None else ()
+    classes = assignClasses(requests, highShare, seed) if highShare is not None else None
+    tsBegin, tsComplete = simulate(requests, servers, prob, seed, tick, makeQueue, changes, classes)
+    stats = {None: s.calcStat(s.calcJCTs(tsBegin, tsComplete))}
+    for jobClass in sorted(set(classes.values())) if classes else ():
+        filenames = [filename for filename, c in classes.items() if c == jobClass]
+        stats[jobClass] = s.calcStat(s.calcJCTs({f: tsBegin[f] for f in filenames},
+                                                {f: tsComplete[f] for f in filenames}))
+    return stats
+
+
+def sweep(testcases, probs, seed=0, tick=0.05, makeQueue=None, testcasesDir=TESTCASES_DIR, slowdown=None,
+          highShare=None):
+    # same keys as the stat dict of s.py, plus prob000_high_p95s etc. per class
+    stat = defaultdict(list)
+    for prob in probs:
+        for tcIndex in testcases:
+            stats = runTestcase(os.path.join(testcasesDir, str(tcIndex)), prob, seed, tick, makeQueue,
+                                slowdown, highShare)
+            for jobClass, (p50, p95) in stats.items():
+                prefix = f'prob{str(prob).zfill(3)}' + (f'_{jobClass}' if jobClass else '')
+                stat[f'{prefix}_p50s'].append(p50)
+                stat[f'{prefix}_p95s'].append(p95)
+    return stat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Discrete-event simulation of the testcases.")
+    parser.add_argument('--t', dest="tci", type=int, help='testcase index')
+    parser.add_argument('--dir', dest="testcasesDir", default=TESTCASES_DIR,
+                        help='directory of the numbered testcases, e.g. ones from workloadGenerator.py')
+    parser.add_argument('--p', dest="prob", type=int, help='probability')
+    parser.add_argument('--seed', dest="seed", type=int, default=0, help='seed for hiding the sizes')
+    parser.add_argument('--tick', dest="tick", type=float, default=0.05,
+                        help='seconds between completion checks of the emulated servers')
+    parser.add_argument('--policy', dest="policy", default=PRIORITY_POLICY,
+                        choices=sorted(policies.POLICIES), help='placement policy, see policies.py')
+    parser.add_argument('--backend', dest="backend", default=HEAP_BACKEND,
+                        choices=[HEAP_BACKEND, NUMPY_BACKEND, SAMPLED_BACKEND],
+                        help='priority backend of the serverQueue policies')
+    parser.add_argument('--d', dest="sampleSize", type=int, default=SAMPLE_SIZE,
+                        help=f'servers compared per decision by the {SAMPLED_BACKEND} backend')
+    parser.add_argument('--config', dest="config", help='JSON file with schedulerConfig fields')
+    parser.add_argument('--slowdown', dest="slowdown", type=float,
+                        help='the fastest server drops to this fraction of its bandwidth mid-trace')
+    parser.add_argument('--high', dest="highShare", type=float,
+                        help=f'fraction of the requests sent with class {HIGH_CLASS}, the rest {LOW_CLASS}')
+    args = parser.parse_args()
+
+    options = {}
+    if issubclass(policies.POLICIES[args.policy], serverQueue):
+        options.update(backend=args.backend, sampleSize=args.sampleSize)
+        if args.config:
+            options.update(config=schedulerConfig.fromFile(args.config))
+    makeQueue = lambda names, startTime, clk: policies.makePolicy(args.policy, names, startTime,
+                                                                  clock=clk, **options)
+    testcases = listTestcases(args.testcasesDir) if args.tci is None else [args.tci]
+    probs = PROBS if args.prob is None else [args.prob]
+    start = time.perf_counter()
+    stat = sweep(testcases, probs, args.seed, args.tick, makeQueue, args.testcasesDir, args.slowdown,
+                 args.highShare)
+    end = time.perf_counter()
+    for k, v in stat.items():
+        print(f"{k}:{v}")
+    print(f"Simulated {len(testcases) * len(probs)} runs in {end - start:.3f}s")
+    avgTimings = s.calcAverageStat(stat)
+    for k in sorted(avgTimings.keys()):
+        print(f'{k}: {avgTimings[k]}')
@@ -0,0 +1,240 @@
+import gc
+import operator
+import os
+import pickle
+import queue
+import threading
+import time
+
+VERSION = 1
+
+# serverRecord slots saved in a snapshot, jobs is copied separately
+SERVER_FIELDS = ("lastUpdateTime", "servicePerJob", "busyTime", "numActiveJobs", "activeLoad",
+                 "bandwidth", "bandwidthWeight", "bandwidthTime", "numAssignedJobs", "assignedLoad",
+                 "estimatingBandwidth", "awaitingForceFeed")
+TIME_FIELDS = ("lastUpdateTime", "bandwidthTime")
+
+
+def captureState(sq):
+    # Plain tuples and dicts only, so pickling them on another thread does
+    # not race with the scheduler. O(servers + jobs), called on the main
+    # thread between two messages. The collector is paused meanwhile, it
+    # would otherwise run many times over the new tuples.
+    values = operator.attrgetter(*SERVER_FIELDS)
+    gcWasEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        servers = {name: (values(d), dict(d.jobs) if d.jobs is not None else None)
+                   for name, d in sq.serverDetails.items()}
+        jobs = {name: tuple(jobDetail) for name, jobDetail in sq.jobDetails.items()}
+        # placement times of the jobs that were held back, the others were
+        # placed when they were admitted
+        placed = {name: sq.jobDetails.placedTime(name) for name, jobDetail in jobs.items()
+                  if sq.jobDetails.placedTime(name) != jobDetail[3]}
+        held = {jobClass: list(heldJobs) for jobClass, heldJobs in sq.heldJobs.items() if heldJobs}
+    finally:
+        if gcWasEnabled:
+            gc.enable()
+    return {
+        "version": VERSION,
+        "clock": sq.clock(),
+        "wallTime": time.time(),
+        "config": sq.config.asDict(),
+        "TFL": sq.TFL,
+        "DL": sq.DL,
+        "servers": servers,
+        "jobs": jobs,
+        "placed": placed,
+        "held": held,
+        "classService": dict(sq.classService),
+    }
+
+
+def saveState(state, path):
+    # written next to path and renamed over it, so a crash never leaves a
+    # half written snapshot behind
+    tmpPath = f"{path}.tmp"
+    with open(tmpPath, "wb") as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmpPath, path)
+
+
+def loadState(path):
+    with open(path, "rb") as file:
+        state = pickle.load(file)
+    if state.get("version") != VERSION:
+        raise ValueError(f"{path}: snapshot version {state.get('version')}, expected {VERSION}")
+    return state
+
+
+def _drain(remaining, bandwidth, elapsed):
+    # Processor sharing of the given remaining loads for elapsed seconds.
+    # Returns the number of jobs finished, smallest first, and the load
+    # served to each of the jobs still running.
+    served = 0.0
+    numActive = len(remaining)
+    numFinished = 0
+    for load in sorted(remaining):
+        if numActive == 0 or bandwidth <= 0:
+            break
+        duration = (load - served) * numActive / bandwidth
+        if duration > elapsed:
+            return numFinished, served + elapsed * bandwidth / numActive
+        elapsed -= duration
+        served = max(served, load)
+        numActive -= 1
+        numFinished += 1
+    return numFinished, served
+
+
+def restoreState(sq, state):
+    # Loads a snapshot into a freshly built serverQueue. Servers missing
+    # from the snapshot stay new and get force fed, jobs on servers that
+    # are gone are dropped. Times are moved to the new clock through the
+    # wall clock, so the downtime counts as time the servers kept working:
+    # jobs that should have drained by now are completed, and the ones
+    # still running are credited the service they got in the meantime.
+    # Returns (restored servers, restored jobs, jobs completed on restore).
+    offset = (sq.clock() - time.time()) - (state["clock"] - state["wallTime"])
+    elapsed = max(0.0, time.time() - state["wallTime"])
+    sq.TFL = state["TFL"]
+    sq.DL = state["DL"]
+
+    numServers = 0
+    for name, (values, jobs) in state["servers"].items():
+        serverDetail = sq.serverDetails.get(name)
+        if serverDetail is None:
+            continue
+        for field, value in zip(SERVER_FIELDS, values):
+            if field in TIME_FIELDS and value is not None:
+                value += offset
+            setattr(serverDetail, field, value)
+        serverDetail.jobs = jobs
+        numServers += 1
+
+    numJobs = 0
+    perServer = {}
+    for jobName, (server, jobSize, load, admitTime) in state["jobs"].items():
+        if server not in sq.serverDetails or server not in state["servers"]:
+            continue
+        sq.jobDetails[jobName] = [server, jobSize, load, admitTime + offset]
+        if jobName in state.get("placed", {}):
+            sq.jobDetails.setPlacedTime(jobName, state["placed"][jobName] + offset)
+        perServer.setdefault(server, []).append(jobName)
+        numJobs += 1
+
+    # jobs held back by admission control, snapshots without any have no
+    # held field
+    for jobClass, heldJobs in state.get("held", {}).items():
+        for jobName, jobSize, arrivalTime in heldJobs:
+            sq.heldJobs[jobClass].append((jobName, jobSize, arrivalTime + offset))
+            sq.numHeld += 1
+    sq.classService.update(state.get("classService", {}))
+
+    numCompleted = 0
+    for server, jobNames in perServer.items():
+        numCompleted += _reconcileServer(sq, sq.serverDetails[server], jobNames, elapsed)
+
+    # the snapshot may come from a different config: a server keeps the
+    # probe stamps exactly while the current config tracks its jobs
+    for serverDetail in sq.serverDetails.values():
+        if sq._isTrackingJobs(serverDetail) and serverDetail.jobs is None:
+            serverDetail.jobs = {}
+            serverDetail.lastUpdateTime = sq.clock()
+        elif not sq._isTrackingJobs(serverDetail) and serverDetail.jobs is not None:
+            serverDetail.jobs = None
+            serverDetail.lastUpdateTime = None
+
+    sq.forceFeedQueue.clear()
+    sq.forceFeedQueue.extend(d for d in sq.serverDetails.values() if d.awaitingForceFeed)
+    sq.numForceFed = len(sq.serverDetails) - len(sq.forceFeedQueue)
+    sq._updatePs()
+    return numServers, numJobs, numCompleted
+
+
+def _reconcileServer(sq, serverDetail, jobNames, elapsed):
+    # A server still estimating B only has the default bandwidth, which
+    # must not decide that its probe has finished: the jobs stay in flight
+    # and the real completion measures B. lastUpdateTime was moved by the
+    # offset, so the next update of the PS clock counts the downtime.
+    if serverDetail.estimatingBandwidth:
+        return 0
+    # remaining load of every job: its load minus the service it got up to
+    # the last update of the PS clock, when the job has a stamp
+    bandwidth = serverDetail.bandwidth
+    if serverDetail.jobs is not None:
+        elapsed = max(0.0, sq.clock() - serverDetail.lastUpdateTime)
+    remaining = {}
+    for jobName in jobNames:
+        load = sq.jobDetails[jobName][2]
+        stamp = serverDetail.jobs.get(jobName) if serverDetail.jobs else None
+        if stamp is not None:
+            load -= (serverDetail.servicePerJob - stamp) / 1_000_000 * bandwidth
+        remaining[jobName] = max(0.0, load)
+    numFinished, served = _drain(list(remaining.values()), bandwidth, elapsed)
+
+    finished = sorted(remaining, key=remaining.get)[:numFinished]
+    for jobName in finished:
+        _, _, load, _ = sq.jobDetails.pop(jobName)
+        serverDetail.numActiveJobs -= 1
+        serverDetail.activeLoad -= load
+        sq.TFL += load
+        if serverDetail.jobs:
+            serverDetail.jobs.pop(jobName, None)
+    if serverDetail.jobs is not None and bandwidth > 0:
+        # the PS clock catches up with the downtime
+        serverDetail.servicePerJob += served / bandwidth * 1_000_000
+        serverDetail.lastUpdateTime = sq.clock()
+    return numFinished
+
+
+class snapshotWriter:
+    # Pickles and writes snapshots on a background thread. Only the newest
+    # pending state is kept: if the disk is slower than the interval, older
+    # states are skipped instead of queueing up.
+
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = queue.Queue(maxsize=1)
+        self.numWritten = 0
+        self.numSkipped = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+
+    def submit(self, state):
+        while True:
+            try:
+                self.pending.put_nowait(state)
+                return
+            except queue.Full:
+                try:
+                    self.pending.get_nowait()
+                    self.numSkipped += 1
+                except queue.Empty:
+                    pass
+
+
+    def close(self):
+        # waits for the pending snapshot to be written
+        if self.thread is None:
+            return
+        self.pending.put(None)
+        self.thread.join()
+        self.thread = None
+
+
+    def _write(self):
+        while True:
+            state = self.pending.get()
+            if state is None:
+                break
+            try:
+                saveState(state, self.path)
+                self.numWritten += 1
+            except OSError as e:
+                self.error = e
@@ -0,0 +1,121 @@
+import queue
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING}
+LEVEL_NAMES = {v: k.upper() for k, v in LEVELS.items()}
+
+_STOP = object()
+
+
+class statusLogger:
+    # Log records are (level, format string, args) tuples put on a bounded
+    # queue. A background thread does the formatting and the writing, so
+    # the scheduling loop only pays for building the tuple. When the queue
+    # is full the record is dropped and counted instead of blocking.
+
+
+    def __init__(self, level=INFO, interval=1.0, maxQueued=1024, stream=None):
+        self.level = level
+        self.interval = interval  # seconds between status snapshots
+        self.stream = stream if stream is not None else sys.stdout
+        self.records = queue.Queue(maxQueued)
+        self.numDropped = 0
+        self.lastStatus = None
+        self.thread = None
+
+
+    def isEnabledFor(self, level):
+        return level >= self.level
+
+
+    def log(self, level, fmt, *args):
+        if level < self.level:
+            return
+        if self.thread is None:
+            self._start()
+        try:
+            self.records.put_nowait((level, fmt, args))
+        except queue.Full:
+            self.numDropped += 1
+
+
+    def debug(self, fmt, *args):
+        self.log(DEBUG, fmt, *args)
+
+
+    def info(self, fmt, *args):
+        self.log(INFO, fmt, *args)
+
+
+    def warning(self, fmt, *args):
+        self.log(WARNING, fmt, *args)
+
+
+    def statusDue(self):
+        # sample the scheduler status at most once per interval
+        if self.level > INFO:
+            return False
+        now = time.monotonic()
+        if self.lastStatus is not None and now - self.lastStatus < self.interval:
+            return False
+        self.lastStatus = now
+        return True
+
+
+    def logStatus(self, snapshot):
+        self.info("{}", _statusFormatter(snapshot))
+
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.records.put(_STOP)
+        self.thread.join()
+        self.thread = None
+
+
+    def _start(self):
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+
+    def _write(self):
+        while True:
+            record = self.records.get()
+            if record is _STOP:
+                break
+            level, fmt, args = record
+            try:
+                message = fmt.format(*args)
+            except Exception as e:
+                message = f"{fmt!r} {args!r} could not be formatted: {e}"
+            self.stream.write(f"[{LEVEL_NAMES[level]}] {message}\n")
+            if self.records.empty():
+                self.stream.flush()
+        if self.numDropped:
+            self.stream.write(f"[WARNING] {self.numDropped} log records were dropped\n")
+        self.stream.flush()
+
+
+class _statusFormatter:
+    # formats a serverQueue.statusSnapshot() lazily, on the logging thread
+
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+
+    def __format__(self, spec):
+        servers, counters, jobs = self.snapshot
+        lines = ["status " + " ".join(f"{k}={v}" for k, v in counters)]
+        for name, numActiveJobs, activeLoad, bandwidth, estimatingBandwidth in servers:
+            lines.append(f"  {name}: NACJ={numActiveJobs} ACL={activeLoad} "
+                         f"B={bandwidth} EB={estimatingBandwidth}")
+        for jobName, jobDetail in jobs:
+            lines.append(f"  {jobName}:{jobDetail}")
+        return "\n".join(lines)
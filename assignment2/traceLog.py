@@ -0,0 +1,82 @@
+import struct
+import time
+
+# Append-only binary log of a scheduler session: MAGIC, then one record per
+# message, a RECORD header (time.monotonic_ns(), kind, payload length)
+# followed by the payload bytes as they went over the socket.
+MAGIC = b"JSTRACE1"
+RECORD = struct.Struct("<QBI")
+
+SERVERNAMES = 0  # the servernames message, e.g. b"A,B,C,"
+INBOUND = 1      # the complete lines of one received chunk, "F" prefix for completions
+OUTBOUND = 2     # the "servername,filename,size" lines sent for that chunk
+
+
+class traceWriter:
+    # Records go to a large write buffer and reach the disk when it is full,
+    # on flush or on close, so recording costs a header pack and a copy
+    # per message in the I/O loop.
+
+
+    def __init__(self, path, bufferSize=1 << 20, clock=time.monotonic_ns):
+        self.file = open(path, "wb", buffering=bufferSize)
+        self.file.write(MAGIC)
+        self.clock = clock
+        self.numRecords = 0
+
+
+    def record(self, kind, payload):
+        self.file.write(RECORD.pack(self.clock(), kind, len(payload)))
+        self.file.write(payload)
+        self.numRecords += 1
+
+
+    def flush(self):
+        self.file.flush()
+
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def readTrace(path):
+    # (time in ns, kind, payload) of every record; a record cut short by a
+    # crash ends the trace
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: not a scheduler trace")
+        while True:
+            header = file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            timeNs, kind, length = RECORD.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length:
+                return
+            yield timeNs, kind, payload
+
+
+def parseInbound(payload):
+    # completed filenames and "filename,size[,class]" requests, like
+    # jobScheduler.lineReader
+    completions = []
+    requests = []
+    for line in payload.decode().split("\n"):
+        if not line:
+            continue
+        if line[0] == "F":
+            completions.append(line[1:])
+        else:
+            requests.append(line)
+    return completions, requests
+
+
+def parseOutbound(payload):
+    # filename -> server of every assignment line
+    assignments = {}
+    for line in payload.decode().split("\n"):
+        if line:
+            server, filename, _ = line.split(",", 2)
+            assignments[filename] = server
+    return assignments
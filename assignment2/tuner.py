@@ -0,0 +1,137 @@
+import argparse
+import functools
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from jobScheduler import schedulerConfig, serverQueue
+import simulator
+
+GRID = "grid"
+RANDOM = "random"
+HALVING = "halving"
+
+# values tried for every field of schedulerConfig
+SPACE = {
+    "defaultBandwidth": [10.0, 25.0, 50.0, 100.0, 200.0],
+    "defaultLoad": [50.0, 100.0, 200.0, 400.0],
+    "loadWeight": [0.0, 0.25, 0.5],
+    "pflThreshold": [250, 500, 1000, 2000, 4000],
+    "pflSmoothing": [0.01, 0.1, 1.0, 10.0],
+    "bandwidthHalfLife": [0.0, 0.5, 2.0, 10.0],
+}
+
+
+def gridConfigs(space=SPACE):
+    fields = list(space)
+    return [dict(zip(fields, values)) for values in itertools.product(*(space[f] for f in fields))]
+
+
+def randomConfigs(n, seed=0, space=SPACE):
+    rnd = random.Random(seed)
+    configs = gridConfigs(space)
+    return rnd.sample(configs, min(n, len(configs)))
+
+
+@functools.lru_cache(maxsize=None)
+def _loadTestcase(tcIndex):
+    return simulator.loadTestcase(os.path.join(simulator.TESTCASES_DIR, str(tcIndex)))
+
+
+def _makeQueue(config, servernames, startTime, clock):
+    return serverQueue(servernames, startTime, clock=clock, config=config)
+
+
+def evaluate(params, pairs, seeds, tick):
+    # mean p95 and p50 over the (prob, testcase) pairs and seeds
+    makeQueue = functools.partial(_makeQueue, schedulerConfig(**params))
+    p50s = []
+    p95s = []
+    for prob, tcIndex in pairs:
+        requests, servers = _loadTestcase(tcIndex)
+        for seed in seeds:
+            tsBegin, tsComplete = simulator.simulate(requests, servers, prob, seed, tick, makeQueue)
+            p50, p95 = simulator.s.calcStat(simulator.s.calcJCTs(tsBegin, tsComplete))
+            p50s.append(p50)
+            p95s.append(p95)
+    return statistics.mean(p95s), statistics.mean(p50s)
+
+
+def evaluateAll(pool, configs, pairs, seeds, tick):
+    futures = [pool.submit(evaluate, params, pairs, seeds, tick) for params in configs]
+    return [(params,) + future.result() for params, future in zip(configs, futures)]
+
+
+def successiveHalving(pool, configs, pairs, seeds, tick, eta=3):
+    # Every rung evaluates the surviving configs on eta times more
+    # (prob, testcase) pairs and keeps the best 1 / eta of them. The last
+    # rung uses every pair.
+    pairs = list(pairs)
+    random.Random(0).shuffle(pairs)
+    numRungs = max(1, math.ceil(math.log(max(len(configs), 1), eta)))
+    results = []
+    for rung in range(numRungs):
+        budget = max(1, math.ceil(len(pairs) / eta ** (numRungs - 1 - rung)))
+        results = sorted(evaluateAll(pool, configs, pairs[:budget], seeds, tick), key=lambda r: r[1])
+        print(f"rung {rung}: {len(configs)} configs on {budget} runs, best p95 {results[0][1]:.3f}")
+        configs = [params for params, _, _ in results[:max(1, len(results) // eta)]]
+    return results
+
+
+def defaultParams():
+    # the current defaults of the fields in SPACE
+    defaults = schedulerConfig().asDict()
+    return {field: defaults[field] for field in SPACE}
+
+
+def printReport(results, top):
+    baseline = defaultParams()
+    print(f"{'rank':>4} {'p95':>8} {'p50':>8}  config")
+    for rank, (params, p95, p50) in enumerate(results[:top], 1):
+        mark = "  (current defaults)" if params == baseline else ""
+        config = " ".join(f"{k}={v}" for k, v in params.items())
+        print(f"{rank:>4} {p95:8.3f} {p50:8.3f}  {config}{mark}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the scheduler constants for the lowest p95 JCT.")
+    parser.add_argument('--mode', dest="mode", choices=[GRID, RANDOM, HALVING], default=HALVING)
+    parser.add_argument('--n', dest="n", type=int, default=81,
+                        help='number of configs sampled for random and halving')
+    parser.add_argument('--seeds', dest="seeds", type=int, default=1,
+                        help='number of size-hiding seeds every run is averaged over')
+    parser.add_argument('--tick', dest="tick", type=float, default=0.05)
+    parser.add_argument('--j', dest="workers", type=int, default=os.cpu_count())
+    parser.add_argument('--top', dest="top", type=int, default=10, help='rows in the report')
+    parser.add_argument('--out', dest="out", help='write every evaluated config as JSON')
+    args = parser.parse_args()
+
+    pairs = [(prob, tcIndex) for prob in simulator.PROBS for tcIndex in simulator.listTestcases()]
+    seeds = list(range(args.seeds))
+    if args.mode == GRID:
+        configs = gridConfigs()
+    else:
+        configs = randomConfigs(args.n)
+    # always compare against the current defaults
+    baseline = defaultParams()
+    if baseline not in configs:
+        configs.append(baseline)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        if args.mode == HALVING:
+            results = successiveHalving(pool, configs, pairs, seeds, args.tick)
+        else:
+            results = sorted(evaluateAll(pool, configs, pairs, seeds, args.tick), key=lambda r: r[1])
+    print(f"Evaluated {len(configs)} configs in {time.perf_counter() - start:.1f}s")
+    printReport(results, args.top)
+
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump([{"config": params, "p95": p95, "p50": p50} for params, p95, p50 in results],
+                      file, indent=2)
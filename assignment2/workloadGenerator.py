@@ -0,0 +1,178 @@
+import argparse
+import itertools
+import math
+import os
+import random
+import string
+import time
+
+from emulator import CONFIG_CLIENT, CONFIG_SERVER, formatSize
+
+POISSON = "poisson"
+ON_OFF = "onoff"
+DIURNAL = "diurnal"
+
+PARETO = "pareto"
+LOGNORMAL = "lognormal"
+
+BANDWIDTHS = [10, 50, 100, 200]  # the bandwidths of the bundled testcases
+
+SIZE_SAMPLES = 100000  # sizes drawn to estimate the mean size
+
+# first lines of the bundled testcases/0 files
+CLIENT_HEADER = "# timestamp(s), filename, filesize\n"
+SERVER_HEADER = "# servername, bandwidth\n"
+
+
+def serverNames():
+    # A..Z, AA..ZZ, AAA.. like spreadsheet columns, so the first 26 servers
+    # are named like in the bundled testcases
+    for length in itertools.count(1):
+        for letters in itertools.product(string.ascii_uppercase, repeat=length):
+            yield "".join(letters)
+
+
+def serverBandwidths(rnd, bandwidths=BANDWIDTHS, sigma=0.0):
+    # one of bandwidths, spread by a lognormal factor when sigma > 0
+    while True:
+        bandwidth = rnd.choice(bandwidths)
+        if sigma > 0:
+            bandwidth *= rnd.lognormvariate(0, sigma)
+        yield max(1, round(bandwidth))
+
+
+def poissonArrivals(rnd, rate):
+    t = 0.0
+    while True:
+        t += rnd.expovariate(rate)
+        yield t
+
+
+def onOffArrivals(rnd, rate, onTime, offTime):
+    # Poisson bursts during on periods, silence during off periods, both of
+    # exponential length. The rate within a burst is raised so the mean
+    # rate stays rate.
+    burstRate = rate * (onTime + offTime) / onTime
+    start = 0.0
+    while True:
+        end = start + rnd.expovariate(1 / onTime)
+        t = start + rnd.expovariate(burstRate)
+        while t < end:
+            yield t
+            t += rnd.expovariate(burstRate)
+        start = end + rnd.expovariate(1 / offTime)
+
+
+def diurnalArrivals(rnd, rate, period, amplitude):
+    # Poisson with rate * (1 + amplitude * sin(2 pi t / period)), by
+    # thinning a Poisson process at the peak rate
+    peakRate = rate * (1 + amplitude)
+    t = 0.0
+    while True:
+        t += rnd.expovariate(peakRate)
+        if rnd.random() * (1 + amplitude) <= 1 + amplitude * math.sin(2 * math.pi * t / period):
+            yield t
+
+
+def paretoSizes(rnd, alpha, minSize, maxSize):
+    # Pareto with shape alpha from minSize, sizes above maxSize are drawn again
+    while True:
+        size = minSize * rnd.paretovariate(alpha)
+        if size <= maxSize:
+            yield max(1, round(size))
+
+
+def lognormalSizes(rnd, median, sigma, maxSize):
+    mu = math.log(median)
+    while True:
+        size = rnd.lognormvariate(mu, sigma)
+        if size <= maxSize:
+            yield max(1, round(size))
+
+
+def meanSize(makeSizes, seed):
+    return sum(itertools.islice(makeSizes(random.Random(seed)), SIZE_SAMPLES)) / SIZE_SAMPLES
+
+
+def writeServers(path, numServers, bandwidths):
+    # streams the config_server lines, returns the total bandwidth
+    total = 0
+    with open(path, "w") as file:
+        file.write(SERVER_HEADER)
+        for name, bandwidth in zip(itertools.islice(serverNames(), numServers), bandwidths):
+            file.write(f"{name},{bandwidth}\n")
+            total += bandwidth
+    return total
+
+
+def writeClient(path, numJobs, arrivals, sizes, wholeSeconds=False):
+    # Streams the config_client lines, filenames are 0, 1, 2, ... like the
+    # bundled testcases; returns the time of the last arrival. Times are
+    # rounded to milliseconds, emulator.py and simulator.py read floats.
+    # The bundled testcases only use whole seconds, which the course
+    # server_client binary may require: wholeSeconds rounds every time
+    # down to its second, turning the arrivals into per-second bursts.
+    t = 0.0
+    with open(path, "w") as file:
+        file.write(CLIENT_HEADER)
+        for filename, t, size in zip(range(numJobs), arrivals, sizes):
+            timestamp = math.floor(t) if wholeSeconds else round(t, 3)
+            file.write(f"{formatSize(timestamp)},{filename},{size}\n")
+    return t
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes a synthetic config_client/config_server testcase.")
+    parser.add_argument('--out', dest="out", required=True, help='testcase directory to write')
+    parser.add_argument('--servers', dest="numServers", type=int, default=1000)
+    parser.add_argument('--jobs', dest="numJobs", type=int, default=100000)
+    parser.add_argument('--seed', dest="seed", type=int, default=0)
+    parser.add_argument('--bandwidths', dest="bandwidths", type=float, nargs='+', default=BANDWIDTHS,
+                        help='bandwidths the servers are drawn from')
+    parser.add_argument('--spread', dest="spread", type=float, default=0.0,
+                        help='sigma of a lognormal factor applied to every bandwidth')
+    parser.add_argument('--arrivals', dest="arrivals", default=POISSON, choices=[POISSON, ON_OFF, DIURNAL])
+    parser.add_argument('--utilization', dest="utilization", type=float, default=0.7,
+                        help='mean offered load as a fraction of the total bandwidth')
+    parser.add_argument('--rate', dest="rate", type=float,
+                        help='mean arrivals per second, overrides --utilization')
+    parser.add_argument('--on', dest="onTime", type=float, default=1.0, help=f'mean {ON_OFF} burst seconds')
+    parser.add_argument('--off', dest="offTime", type=float, default=4.0, help=f'mean {ON_OFF} pause seconds')
+    parser.add_argument('--period', dest="period", type=float, default=60.0,
+                        help=f'seconds of one {DIURNAL} cycle')
+    parser.add_argument('--amplitude', dest="amplitude", type=float, default=0.8,
+                        help=f'{DIURNAL} rate swing, 0 to 1')
+    parser.add_argument('--sizes', dest="sizes", default=PARETO, choices=[PARETO, LOGNORMAL])
+    parser.add_argument('--alpha', dest="alpha", type=float, default=1.2, help=f'{PARETO} shape')
+    parser.add_argument('--min_size', dest="minSize", type=float, default=10.0, help=f'{PARETO} minimum')
+    parser.add_argument('--median', dest="median", type=float, default=50.0, help=f'{LOGNORMAL} median')
+    parser.add_argument('--sigma', dest="sigma", type=float, default=1.5, help=f'{LOGNORMAL} sigma')
+    parser.add_argument('--max_size', dest="maxSize", type=float, default=10000.0)
+    parser.add_argument('--whole_seconds', dest="wholeSeconds", action='store_true',
+                        help='round arrival times down to whole seconds like the bundled testcases, '
+                             'the course server_client binary may not accept fractions')
+    args = parser.parse_args()
+
+    if args.sizes == PARETO:
+        makeSizes = lambda rnd: paretoSizes(rnd, args.alpha, args.minSize, args.maxSize)
+    else:
+        makeSizes = lambda rnd: lognormalSizes(rnd, args.median, args.sigma, args.maxSize)
+
+    start = time.perf_counter()
+    os.makedirs(args.out, exist_ok=True)
+    rnd = random.Random(args.seed)
+    totalBandwidth = writeServers(os.path.join(args.out, CONFIG_SERVER), args.numServers,
+                                  serverBandwidths(rnd, args.bandwidths, args.spread))
+    rate = args.rate
+    if rate is None:
+        rate = args.utilization * totalBandwidth / meanSize(makeSizes, args.seed)
+    if args.arrivals == POISSON:
+        arrivals = poissonArrivals(rnd, rate)
+    elif args.arrivals == ON_OFF:
+        arrivals = onOffArrivals(rnd, rate, args.onTime, args.offTime)
+    else:
+        arrivals = diurnalArrivals(rnd, rate, args.period, args.amplitude)
+    duration = writeClient(os.path.join(args.out, CONFIG_CLIENT), args.numJobs, arrivals, makeSizes(rnd),
+                           args.wholeSeconds)
+    print(f"{args.numServers} servers, {args.numJobs} jobs over {duration:.1f}s at {rate:.1f} jobs/s "
+          f"in {time.perf_counter() - start:.1f}s")